@@ -1,12 +1,47 @@
 """Main FastAPI application."""
+import asyncio
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from loguru import logger
 
 from app.api.routes.assemble_map import router as assemble_map_router
-from app.config import BACKEND_HOST, BACKEND_PORT
+from app.api.routes.batch import router as batch_router
+from app.api.routes.drafts import router as drafts_router
+from app.api.routes.jobs import router as jobs_router
+from app.api.routes.profiles import router as profiles_router
+from app.api.routes.selfies import router as selfies_router
+from app.services.cleanup import cleanup_loop
+from app.services.readiness import readiness, warm_up
+from app.config import BACKEND_HOST, BACKEND_PORT, BACKEND_RELOAD, BACKEND_WORKERS, SELFIE_PUBLIC_BASE_URL
+from app.utils import metrics
+from app.utils.http import close_http_client
+from app.utils.tracing import setup_logging
+
+setup_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not SELFIE_PUBLIC_BASE_URL:
+        logger.warning(
+            "⚠️ SELFIE_PUBLIC_BASE_URL is not set: selfies are sent to Kolors inline as base64. "
+            "Set it so Kolors fetches them from /api/selfies/{hash}"
+        )
+    # Fonts, per-format templates, the Kolors connection and a tiny render,
+    # so the first job after a deploy does not pay for them
+    await warm_up()
+    # Expired tiles, old jobs and their files would otherwise fill the disk
+    cleanup = asyncio.create_task(cleanup_loop())
+    yield
+    cleanup.cancel()
+    await close_http_client()
+
 
-app = FastAPI(title="Wish Map Backend - Kolors MVP")
+app = FastAPI(title="Wish Map Backend - Kolors MVP", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +53,11 @@ app.add_middleware(
 
 # Include routers
 app.include_router(assemble_map_router, prefix="/api", tags=["map"])
+app.include_router(jobs_router, prefix="/api", tags=["jobs"])
+app.include_router(batch_router, prefix="/api", tags=["batch"])
+app.include_router(drafts_router, prefix="/api", tags=["drafts"])
+app.include_router(profiles_router, prefix="/api", tags=["admin"])
+app.include_router(selfies_router, prefix="/api", tags=["selfies"])
 
 
 @app.get("/health")
@@ -25,10 +65,31 @@ async def health():
     return {"status": "ok", "service": "wish-map-backend"}
 
 
+@app.get("/ready")
+async def ready():
+    # Load balancer check: 503 until warm-up is done or while a dependency is down
+    is_ready, checks = await readiness()
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"status": "ready" if is_ready else "not_ready", **checks},
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # Per worker process: Kolors outcomes, retries, hedges, circuit state
+    return metrics.render()
+
+
 if __name__ == "__main__":
     import sys
     from pathlib import Path
     # Add project root to path
     project_root = Path(__file__).resolve().parent.parent.parent
     sys.path.insert(0, str(project_root))
-    uvicorn.run("app.api.main:app", host=BACKEND_HOST, port=BACKEND_PORT, reload=True)
+    if BACKEND_WORKERS > 1:
+        # Production mode: job state, tile cache and rate limits live in the
+        # shared SQLite store, so any worker can serve any job.
+        uvicorn.run("app.api.main:app", host=BACKEND_HOST, port=BACKEND_PORT, workers=BACKEND_WORKERS)
+    else:
+        uvicorn.run("app.api.main:app", host=BACKEND_HOST, port=BACKEND_PORT, reload=BACKEND_RELOAD)
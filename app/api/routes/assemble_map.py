@@ -1,142 +1,297 @@
 """Assemble map route handler."""
-import traceback
 import base64
+import hashlib
 import uuid
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 from loguru import logger
 
-from app.services.kolors_client import get_client
+from app.api.routes.profiles import profiling_requested
+from app.services.job_runner import JobCancelled, run_job, wait_for_batch_turn
+from app.services.job_store import JobRecord, get_store
 from app.services.map_assembler import get_assembler
+from app.services.map_pipeline import generate_tiles
+from app.services.selfies import prepare_selfie, selfie_path, selfie_public_url
 from app.utils.formats import get_format_dimensions
 from app.config import TMP_DIR
+from app.utils.deadline import Deadline, DeadlineExceeded
 from app.utils.images import create_placeholder
+from app.utils.profiling import profile_request
+from app.utils.tracing import job_context, span
 
 router = APIRouter()
 
 
 class AssembleMapRequest(BaseModel):
+    job_id: Optional[str] = None  # Client-chosen id, used to cancel the job
     wishes: List[str]
     format: str  # "phone", "pc", "a4"
-    selfie_url: str  # URL to selfie image
+    selfie_url: Optional[str] = None  # URL to selfie image
+    selfie_b64: Optional[str] = None  # Selfie bytes, preferred over selfie_url
+    deadline_seconds: Optional[float] = None  # How long the client will wait for the answer
 
 
 class AssembleMapResponse(BaseModel):
     status: str
+    job_id: str = ""
     generated_image_urls: List[str]
     final_map_url: str
-    map_b64: str
+    map_b64: str  # Full-resolution PNG
+    preview_b64: str = ""  # Size-capped JPEG preview
+    map_hash: str = ""  # sha256 of the PNG, lets clients reuse uploads
+    # Indexes of wishes rendered as placeholders (failed or past the deadline)
+    degraded_tiles: List[int] = []
+    # Indexes of wishes generated by this request rather than taken from the tile cache
+    regenerated_tiles: List[int] = []
+
+
+class EditMapRequest(BaseModel):
+    job_id: Optional[str] = None  # Client-chosen id of the new job
+    wishes: List[str]  # Full wish list after the edit
+    format: Optional[str] = None  # Defaults to the format of the edited map
+    # Original selfie, needed only if the prepared copy of the edited map is gone
+    selfie_url: Optional[str] = None
+    selfie_b64: Optional[str] = None
+    deadline_seconds: Optional[float] = None
 
 
 @router.post("/assemble_map", response_model=AssembleMapResponse)
-async def assemble_map_endpoint(payload: AssembleMapRequest):
-    try:
-        # Validate format
+async def assemble_map_endpoint(payload: AssembleMapRequest, request: Request, response: Response):
+    with job_context(payload.job_id) as job_id:
         try:
-            width, height = get_format_dimensions(payload.format)
-        except ValueError as format_err:
-            logger.error(f"Invalid format: {payload.format}")
-            raise HTTPException(status_code=400, detail=str(format_err))
-
-        # Validate wishes
-        if len(payload.wishes) < 3 or len(payload.wishes) > 9:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Must have 3-9 wishes, got {len(payload.wishes)}"
+            deadline = Deadline(payload.deadline_seconds)
+            # Checked first: a rejected profiling request must not leave a job behind
+            profiled = profiling_requested(request, job_id)
+            # Registered right away so a cancel reaching any worker finds the job
+            get_store().create_job(job_id, payload.format, payload.wishes)
+            if profiled:
+                response.headers["X-Profile-Url"] = f"/api/profiles/{job_id}"
+                async with profile_request(job_id):
+                    return await run_job(job_id, _assemble_map(payload, job_id, deadline))
+            return await run_job(job_id, _assemble_map(payload, job_id, deadline))
+        except JobCancelled:
+            # Tiles finished before the cancel are already in the tile cache
+            logger.info("🛑 Job cancelled, stopped generation")
+            return AssembleMapResponse(
+                status="cancelled",
+                job_id=job_id,
+                generated_image_urls=[],
+                final_map_url="",
+                map_b64=""
             )
 
-        # Validate selfie URL
-        if not payload.selfie_url.startswith("http"):
-            raise HTTPException(400, "Invalid selfie URL")
+
+@router.post("/jobs/{parent_id}/edit", response_model=AssembleMapResponse)
+async def edit_map_endpoint(parent_id: str, payload: EditMapRequest):
+    """
+    Re-assemble a finished map with a changed wish list.
+
+    Only wishes that are new or changed are generated; the rest come from the
+    tile cache, which is keyed by selfie and wish text.
+    """
+    parent = get_store().get_job(parent_id)
+    if parent is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {parent_id}")
+    if not parent.selfie_hash:
+        raise HTTPException(status_code=409, detail=f"Job {parent_id} has no stored selfie, start a new map")
+
+    with job_context(payload.job_id) as job_id:
+        try:
+            deadline = Deadline(payload.deadline_seconds)
+            get_store().create_job(job_id, payload.format or parent.format, payload.wishes)
+            return await run_job(job_id, _edit_map(parent, payload, job_id, deadline))
+        except JobCancelled:
+            logger.info("🛑 Job cancelled, stopped generation")
+            return AssembleMapResponse(
+                status="cancelled",
+                job_id=job_id,
+                generated_image_urls=[],
+                final_map_url="",
+                map_b64=""
+            )
+
+
+def validate_map(format_key: str, wishes: List[str]) -> Tuple[int, int]:
+    """Check the format and wish count; returns the map size."""
+    try:
+        width, height = get_format_dimensions(format_key)
+    except ValueError as format_err:
+        logger.error(f"Invalid format: {format_key}")
+        raise HTTPException(status_code=400, detail=str(format_err))
+
+    if len(wishes) < 3 or len(wishes) > 9:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Must have 3-9 wishes, got {len(wishes)}"
+        )
+    return width, height
+
+
+async def resolve_selfie(
+    selfie_url: Optional[str], selfie_b64: Optional[str], deadline: Optional[Deadline] = None
+) -> Tuple[str, str]:
+    """
+    Prepare the selfie once; returns its hash and the URL Kolors should fetch it from.
+
+    The URL is empty when SELFIE_PUBLIC_BASE_URL is not set: Kolors then gets the
+    prepared selfie inline. The client's selfie_url is never passed on, since it
+    may carry credentials (Telegram file URLs contain the bot token).
+    """
+    if selfie_url and not selfie_url.startswith("http"):
+        raise HTTPException(400, "Invalid selfie URL")
+
+    with span("selfie"):
+        try:
+            selfie_hash = await (deadline or Deadline()).run(prepare_selfie(selfie_url, selfie_b64), "selfie")
+        except ValueError as selfie_err:
+            raise HTTPException(status_code=400, detail=str(selfie_err))
+
+    reference_url = selfie_public_url(selfie_hash) or ""
+    logger.info(f"➡ Selfie: {selfie_hash} -> {reference_url or 'inline'}")
+    return selfie_hash, reference_url
+
+
+async def _assemble_map(payload: AssembleMapRequest, job_id: str, deadline: Deadline) -> AssembleMapResponse:
+    try:
+        width, height = validate_map(payload.format, payload.wishes)
 
         logger.info("📌 Starting assemble_map")
         logger.info(f"➡ Wishes: {payload.wishes}")
-        logger.info(f"➡ Selfie URL: {payload.selfie_url}")
         logger.info(f"➡ Format: {payload.format} = {width}x{height}")
 
-        kolors_client = get_client()
-        assembler = get_assembler()
-
-        generated_urls = []
-
-        # Generate each wish image
-        for idx, wish in enumerate(payload.wishes):
-            logger.info(f"🖼 Generating image {idx+1}/{len(payload.wishes)}: {wish}")
-
-            try:
-                image_url = await kolors_client.generate_wish_image(
-                    wish_text=wish,
-                    photo_url=payload.selfie_url,   # ✔ FIXED
-                    width=width,
-                    height=height
-                )
-
-                if image_url:
-                    logger.info(f"✔ Image generated: {image_url}")
-                    generated_urls.append(image_url)
-                else:
-                    logger.warning(f"❌ Kolors failed, making placeholder...")
-                    placeholder_path = TMP_DIR / f"placeholder-{uuid.uuid4().hex}.png"
-                    create_placeholder(width, height, wish[:50], placeholder_path)
-                    generated_urls.append(f"placeholder:{placeholder_path}")
-
-            except Exception as e:
-                logger.error(f"❌ Exception during generation: {e}")
-                traceback.print_exc()
-                placeholder_path = TMP_DIR / f"placeholder-{uuid.uuid4().hex}.png"
-                create_placeholder(width, height, wish[:50], placeholder_path)
-                generated_urls.append(f"placeholder:{placeholder_path}")
-
-        # No images?
-        if not generated_urls:
-            fallback = TMP_DIR / f"fallback-{uuid.uuid4().hex}.png"
-            create_placeholder(width, height, "Wish Map", fallback)
-            generated_urls = [f"placeholder:{fallback}"]
-
-        # Convert placeholder paths
-        images_for_assembly = [
-            url.replace("placeholder:", "") if url.startswith("placeholder:") else url
-            for url in generated_urls
-        ]
-
-        # FINAL MAP
-        map_path = TMP_DIR / f"final-map-{uuid.uuid4().hex}.png"
+        selfie_hash, reference_url = await resolve_selfie(payload.selfie_url, payload.selfie_b64, deadline)
 
+        return await render_map(
+            job_id, payload.wishes, payload.format, width, height, selfie_hash, reference_url, deadline
+        )
+
+    except HTTPException as e:
+        # The job was registered on entry; do not leave it "running"
+        get_store().update_job(job_id, status="error", error=str(e.detail))
+        raise
+    except Exception as e:
+        return error_response(job_id, e)
+
+
+async def _edit_map(parent: JobRecord, payload: EditMapRequest, job_id: str, deadline: Deadline) -> AssembleMapResponse:
+    try:
+        format_key = payload.format or parent.format
+        width, height = validate_map(format_key, payload.wishes)
+
+        if selfie_path(parent.selfie_hash).exists():
+            selfie_path(parent.selfie_hash).touch()
+            selfie_hash, reference_url = parent.selfie_hash, selfie_public_url(parent.selfie_hash) or ""
+        elif payload.selfie_url or payload.selfie_b64:
+            selfie_hash, reference_url = await resolve_selfie(payload.selfie_url, payload.selfie_b64, deadline)
+        else:
+            raise HTTPException(409, "The selfie of this map is gone, send selfie_url or selfie_b64")
+
+        changed = [wish for wish in payload.wishes if wish not in parent.wishes]
+        logger.info(f"✏️ Editing map {parent.job_id}: {len(changed)} new of {len(payload.wishes)} wishes")
+        logger.info(f"➡ Wishes: {payload.wishes}")
+
+        return await render_map(
+            job_id, payload.wishes, format_key, width, height, selfie_hash, reference_url, deadline
+        )
+
+    except HTTPException as e:
+        # The job was registered on entry; do not leave it "running"
+        get_store().update_job(job_id, status="error", error=str(e.detail))
+        raise
+    except Exception as e:
+        return error_response(job_id, e)
+
+
+async def render_map(
+    job_id: str,
+    wishes: List[str],
+    format_key: str,
+    width: int,
+    height: int,
+    selfie_hash: str,
+    reference_url: str,
+    deadline: Deadline,
+    low_priority: bool = False,
+) -> AssembleMapResponse:
+    """
+    Generate (or reuse) the tiles, assemble the map and encode the response.
+
+    Low-priority (batch) maps yield to interactive jobs, for a bounded time,
+    before every tile and before rendering.
+    """
+    assembler = get_assembler()
+    store = get_store()
+    store.create_job(job_id, format_key, wishes, selfie_hash, reference_url)
+
+    tiles = await generate_tiles(
+        job_id, wishes, reference_url, selfie_hash, width, height, deadline, low_priority=low_priority
+    )
+    generated_urls = [tile.url for tile in tiles]
+    degraded_tiles = [idx for idx, tile in enumerate(tiles) if tile.degraded]
+    regenerated_tiles = [idx for idx, tile in enumerate(tiles) if not tile.cached]
+
+    # FINAL MAP
+    if low_priority:
+        await deadline.run(wait_for_batch_turn(), "batch turn")
+    map_path = TMP_DIR / f"final-map-{uuid.uuid4().hex}.png"
+    preview_path = map_path.with_suffix(".preview.jpg")
+
+    with span("assemble"):
         await assembler.assemble(
-            image_urls=images_for_assembly,
-            labels=payload.wishes,
+            image_urls=[tile.source for tile in tiles],
+            labels=wishes,
             output_path=map_path,
             width=width,
-            height=height
+            height=height,
+            preview_path=preview_path,
+            deadline=deadline
         )
 
-        map_b64 = base64.b64encode(map_path.read_bytes()).decode()
+    with span("encode"):
+        map_bytes = map_path.read_bytes()
+        map_b64 = base64.b64encode(map_bytes).decode()
+        preview_b64 = base64.b64encode(preview_path.read_bytes()).decode()
+        map_hash = hashlib.sha256(map_bytes).hexdigest()
+
+    store.update_job(job_id, status="success", result_path=str(map_path))
+
+    return AssembleMapResponse(
+        status="success",
+        job_id=job_id,
+        generated_image_urls=generated_urls,
+        final_map_url=f"file://{map_path}",
+        map_b64=map_b64,
+        preview_b64=preview_b64,
+        map_hash=map_hash,
+        degraded_tiles=degraded_tiles,
+        regenerated_tiles=regenerated_tiles
+    )
 
+
+def error_response(job_id: str, e: Exception) -> AssembleMapResponse:
+    """Record the failure and answer with a placeholder image instead of a 500."""
+    if isinstance(e, DeadlineExceeded):
+        logger.warning(f"⏰ {e}, answering with an error")
+    else:
+        logger.opt(exception=True).critical(f"🔥 INTERNAL ERROR: {e}")
+    try:
+        get_store().update_job(job_id, status="error", error=str(e))
+    except Exception as store_err:
+        logger.error(f"Failed to record job error: {store_err}")
+    # Try to return a fallback response instead of raising 500
+    try:
+        fallback_path = TMP_DIR / f"error-fallback-{uuid.uuid4().hex}.png"
+        create_placeholder(1024, 1024, "Ошибка генерации", fallback_path)
+        map_b64 = base64.b64encode(fallback_path.read_bytes()).decode()
         return AssembleMapResponse(
-            status="success",
-            generated_image_urls=generated_urls,
-            final_map_url=f"file://{map_path}",
+            status="error",
+            job_id=job_id,
+            generated_image_urls=[],
+            final_map_url=f"file://{fallback_path}",
             map_b64=map_b64
         )
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.critical(f"🔥 INTERNAL ERROR: {e}")
-        traceback.print_exc()
-        # Try to return a fallback response instead of raising 500
-        try:
-            fallback_path = TMP_DIR / f"error-fallback-{uuid.uuid4().hex}.png"
-            create_placeholder(1024, 1024, "Ошибка генерации", fallback_path)
-            map_b64 = base64.b64encode(fallback_path.read_bytes()).decode()
-            return AssembleMapResponse(
-                status="error",
-                generated_image_urls=[],
-                final_map_url=f"file://{fallback_path}",
-                map_b64=map_b64
-            )
-        except:
-            raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+    except:
+        raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
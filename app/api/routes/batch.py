@@ -0,0 +1,157 @@
+"""Batch map generation route handler."""
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from loguru import logger
+from pydantic import ValidationError
+
+from app.api.routes.assemble_map import AssembleMapRequest, render_map, resolve_selfie, validate_map
+from app.config import BATCH_CONCURRENCY, BATCH_MAX_ITEMS, KOLORS_COST_PER_IMAGE
+from app.services.job_runner import JobCancelled, cancel_job, run_job
+from app.services.job_store import get_store
+from app.utils import metrics
+from app.utils.deadline import Deadline
+from app.utils.tracing import job_context, new_job_id
+
+router = APIRouter()
+
+
+def _parse_specs(body: bytes, content_type: str) -> List[AssembleMapRequest]:
+    """
+    Accept a JSON list of map specs, {"items": [...]}, or JSON Lines
+    (application/x-ndjson, application/jsonl) with one spec per line.
+    """
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            raw = [json.loads(line) for line in body.decode().splitlines() if line.strip()]
+        else:
+            raw = json.loads(body or b"null")
+            if isinstance(raw, dict):
+                raw = raw.get("items")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {e}")
+
+    if not isinstance(raw, list) or not raw:
+        raise HTTPException(status_code=400, detail="Batch must contain a non-empty list of map specs")
+    if len(raw) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {BATCH_MAX_ITEMS} maps, got {len(raw)}")
+
+    specs = []
+    for index, item in enumerate(raw):
+        try:
+            specs.append(AssembleMapRequest.model_validate(item))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=f"Item {index}: {e.errors()}")
+    return specs
+
+
+async def _run_item(index: int, spec: AssembleMapRequest, job_id: str, include_images: bool) -> Dict[str, Any]:
+    """Render one map of a batch; failures become an error line instead of failing the batch."""
+    started = time.monotonic()
+    line: Dict[str, Any] = {"index": index, "job_id": job_id}
+    with job_context(job_id):
+        try:
+            get_store().create_job(job_id, spec.format, spec.wishes, lane="batch")
+            width, height = validate_map(spec.format, spec.wishes)
+            deadline = Deadline(spec.deadline_seconds)
+            selfie_hash, reference_url = await resolve_selfie(spec.selfie_url, spec.selfie_b64, deadline)
+            result = await run_job(
+                job_id,
+                render_map(
+                    job_id, spec.wishes, spec.format, width, height, selfie_hash, reference_url,
+                    deadline, low_priority=True,
+                ),
+                interactive=False,
+            )
+            generated = [idx for idx in result.regenerated_tiles if idx not in result.degraded_tiles]
+            line.update(
+                status="success",
+                map_url=f"/api/jobs/{job_id}/map",
+                map_hash=result.map_hash,
+                degraded_tiles=result.degraded_tiles,
+                generated_tiles=len(generated),
+                cached_tiles=len(spec.wishes) - len(result.regenerated_tiles),
+            )
+            if include_images:
+                line["map_b64"] = result.map_b64
+                line["preview_b64"] = result.preview_b64
+        except JobCancelled:
+            line["status"] = "cancelled"
+        except HTTPException as e:
+            get_store().update_job(job_id, status="error", error=str(e.detail))
+            line.update(status="error", error=e.detail)
+        except Exception as e:
+            logger.opt(exception=True).error(f"❌ Batch item {index} failed: {e}")
+            get_store().update_job(job_id, status="error", error=str(e))
+            line.update(status="error", error=str(e))
+    line["duration_seconds"] = round(time.monotonic() - started, 2)
+    metrics.inc("batch_maps_total", status=line["status"])
+    return line
+
+
+async def _stream_batch(
+    batch_id: str, specs: List[AssembleMapRequest], include_images: bool
+) -> AsyncIterator[bytes]:
+    """Yield one NDJSON line per finished map, in completion order, then a summary line."""
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    job_ids = [spec.job_id or f"{batch_id}-{index}" for index, spec in enumerate(specs)]
+
+    async def run(index: int) -> Dict[str, Any]:
+        async with semaphore:
+            return await _run_item(index, specs[index], job_ids[index], include_images)
+
+    tasks = [asyncio.create_task(run(index)) for index in range(len(specs))]
+    counts = {"success": 0, "error": 0, "cancelled": 0}
+    generated_tiles = cached_tiles = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            counts[line["status"]] += 1
+            generated_tiles += line.get("generated_tiles", 0)
+            cached_tiles += line.get("cached_tiles", 0)
+            yield (json.dumps(line, ensure_ascii=False) + "\n").encode()
+    finally:
+        # The client went away: stop the maps that have not finished
+        for task, job_id in zip(tasks, job_ids):
+            if not task.done():
+                cancel_job(job_id)
+                task.cancel()
+
+    elapsed = time.monotonic() - started
+    metrics.inc("batch_tiles_total", generated_tiles, source="generated")
+    metrics.inc("batch_tiles_total", cached_tiles, source="cache")
+    summary = {
+        "batch_id": batch_id,
+        "total": len(specs),
+        **counts,
+        "elapsed_seconds": round(elapsed, 2),
+        "maps_per_minute": round(counts["success"] / elapsed * 60, 2) if elapsed > 0 else None,
+        "generated_tiles": generated_tiles,
+        "cached_tiles": cached_tiles,
+        "estimated_cost": round(generated_tiles * KOLORS_COST_PER_IMAGE, 4),
+    }
+    logger.info(f"📦 Batch {batch_id} finished: {summary}")
+    yield (json.dumps({"summary": summary}) + "\n").encode()
+
+
+@router.post("/batch")
+async def batch_endpoint(request: Request, include_images: bool = False):
+    """
+    Render many maps in the low-priority lane and stream NDJSON results.
+
+    Maps are rendered BATCH_CONCURRENCY at a time and yield to interactive
+    jobs; tiles are shared with them through the tile cache.
+    """
+    specs = _parse_specs(await request.body(), request.headers.get("content-type", ""))
+    batch_id = new_job_id()
+    logger.info(f"📦 Batch {batch_id} accepted: {len(specs)} maps")
+    return StreamingResponse(
+        _stream_batch(batch_id, specs, include_images),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id},
+    )
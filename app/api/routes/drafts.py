@@ -0,0 +1,138 @@
+"""Draft map route handlers: wishes start generating while they are typed."""
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+from loguru import logger
+from pydantic import BaseModel
+
+from app.api.routes.assemble_map import (
+    AssembleMapResponse,
+    error_response,
+    render_map,
+    resolve_selfie,
+    validate_map,
+)
+from app.services.drafts import release_dropped, submit_wish
+from app.services.job_runner import JobCancelled, run_job
+from app.services.job_store import JobRecord, get_store
+from app.utils.deadline import Deadline
+from app.utils.tracing import job_context
+
+router = APIRouter()
+
+MAX_DRAFT_WISHES = 9
+
+
+class DraftRequest(BaseModel):
+    draft_id: Optional[str] = None  # Client-chosen id, used to cancel the draft
+    selfie_url: Optional[str] = None
+    selfie_b64: Optional[str] = None
+
+
+class DraftResponse(BaseModel):
+    draft_id: str
+    status: str
+    wishes: List[str]
+
+
+class DraftWishRequest(BaseModel):
+    wish: str
+
+
+class FinalizeDraftRequest(BaseModel):
+    job_id: Optional[str] = None  # Id of the map job
+    format: str  # "phone", "pc", "a4"
+    wishes: Optional[List[str]] = None  # Final list; defaults to the wishes added to the draft
+    deadline_seconds: Optional[float] = None
+
+
+def _get_open_draft(draft_id: str) -> JobRecord:
+    draft = get_store().get_job(draft_id)
+    if draft is None:
+        raise HTTPException(status_code=404, detail=f"Unknown draft: {draft_id}")
+    if draft.status != "draft":
+        raise HTTPException(status_code=409, detail=f"Draft {draft_id} is {draft.status}")
+    return draft
+
+
+@router.post("/drafts", response_model=DraftResponse)
+async def create_draft_endpoint(payload: DraftRequest):
+    with job_context(payload.draft_id) as draft_id:
+        selfie_hash, reference_url = await resolve_selfie(payload.selfie_url, payload.selfie_b64)
+        # The format is chosen later; tiles do not depend on it
+        get_store().create_job(draft_id, "", [], selfie_hash, reference_url, status="draft")
+        logger.info(f"🔮 Draft opened for selfie {selfie_hash}")
+        return DraftResponse(draft_id=draft_id, status="draft", wishes=[])
+
+
+@router.post("/drafts/{draft_id}/wishes", response_model=DraftResponse)
+async def add_draft_wish_endpoint(draft_id: str, payload: DraftWishRequest):
+    """Add a wish to the draft and start generating its tile right away."""
+    draft = _get_open_draft(draft_id)
+    wish = payload.wish.strip()
+    if not wish:
+        raise HTTPException(status_code=400, detail="Wish must not be empty")
+
+    wishes = draft.wishes
+    if wish not in wishes:
+        if len(wishes) >= MAX_DRAFT_WISHES:
+            raise HTTPException(status_code=400, detail=f"A draft holds at most {MAX_DRAFT_WISHES} wishes")
+        wishes = [*wishes, wish]
+        get_store().set_wishes(draft_id, wishes)
+
+    with job_context(draft_id):
+        submit_wish(draft_id, wishes.index(wish), wish, draft.reference_url, draft.selfie_hash)
+    return DraftResponse(draft_id=draft_id, status="draft", wishes=wishes)
+
+
+@router.post("/drafts/{draft_id}/finalize", response_model=AssembleMapResponse)
+async def finalize_draft_endpoint(draft_id: str, payload: FinalizeDraftRequest):
+    """
+    Lay out and assemble the map of a draft. Tiles that finished while the
+    user was typing come from the tile cache; running ones are waited for.
+    """
+    draft = _get_open_draft(draft_id)
+    wishes = payload.wishes if payload.wishes is not None else draft.wishes
+
+    with job_context(payload.job_id) as job_id:
+        try:
+            deadline = Deadline(payload.deadline_seconds)
+            get_store().create_job(job_id, payload.format, wishes)
+            return await run_job(job_id, _finalize_draft(draft, wishes, payload.format, job_id, deadline))
+        except JobCancelled:
+            logger.info("🛑 Job cancelled, stopped generation")
+            return AssembleMapResponse(
+                status="cancelled",
+                job_id=job_id,
+                generated_image_urls=[],
+                final_map_url="",
+                map_b64=""
+            )
+
+
+async def _finalize_draft(
+    draft: JobRecord, wishes: List[str], format_key: str, job_id: str, deadline: Deadline
+) -> AssembleMapResponse:
+    try:
+        width, height = validate_map(format_key, wishes)
+        store = get_store()
+        # Workers still generating tiles of this draft read the final list from here
+        store.set_wishes(draft.job_id, wishes)
+        store.update_job(draft.job_id, status="finalized")
+        release_dropped(draft.job_id, wishes)
+
+        speculative = len([wish for wish in wishes if wish in draft.wishes])
+        logger.info(f"🔮 Finalizing draft {draft.job_id}: {speculative}/{len(wishes)} tiles started early")
+        logger.info(f"➡ Wishes: {wishes}")
+        logger.info(f"➡ Format: {format_key} = {width}x{height}")
+
+        return await render_map(
+            job_id, wishes, format_key, width, height, draft.selfie_hash, draft.reference_url, deadline
+        )
+
+    except HTTPException as e:
+        # The job was registered on entry; do not leave it "running"
+        get_store().update_job(job_id, status="error", error=str(e.detail))
+        raise
+    except Exception as e:
+        return error_response(job_id, e)
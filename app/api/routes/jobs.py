@@ -0,0 +1,63 @@
+"""Job status route handler."""
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+
+from app.services.job_runner import cancel_job
+from app.services.job_store import get_store
+
+router = APIRouter()
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # "running", "success", "error", "cancelled"
+    format: str
+    wishes: List[str]
+    total: int
+    done: int
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def job_status_endpoint(job_id: str):
+    job = get_store().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return JobStatusResponse(
+        job_id=job.job_id,
+        status=job.status,
+        format=job.format,
+        wishes=job.wishes,
+        total=job.total,
+        done=job.done,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job_endpoint(job_id: str):
+    status = cancel_job(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    if status != "cancelled":
+        raise HTTPException(status_code=409, detail=f"Job {job_id} already finished: {status}")
+    return {"status": "cancelled", "job_id": job_id}
+
+
+@router.get("/jobs/{job_id}/map")
+async def job_map_endpoint(job_id: str):
+    job = get_store().get_job(job_id)
+    if job is None or job.status != "success" or not job.result_path:
+        raise HTTPException(status_code=404, detail=f"No finished map for job: {job_id}")
+    path = Path(job.result_path)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"Map file of job {job_id} is gone")
+    return FileResponse(path, media_type="image/png", filename=f"wish-map-{job_id}.png")
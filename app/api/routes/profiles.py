@@ -0,0 +1,47 @@
+"""Admin-only access to request profiles."""
+import hmac
+import re
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse
+
+from app.config import ADMIN_KEY
+from app.utils.profiling import profile_path
+
+router = APIRouter()
+
+# Job ids double as file names of saved profiles
+_PROFILE_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def require_admin(request: Request) -> None:
+    """Reject the request unless it carries the configured X-Admin-Key."""
+    key = request.headers.get("x-admin-key", "")
+    if not ADMIN_KEY or not hmac.compare_digest(key, ADMIN_KEY):
+        raise HTTPException(status_code=403, detail="Admin key required")
+
+
+def profiling_requested(request: Request, job_id: str) -> bool:
+    """
+    True if the request asks to be profiled (X-Profile: 1 or ?profile=1).
+
+    Raises 403 without a valid admin key, and 400 if the job id cannot be used
+    as a profile name.
+    """
+    flag = request.headers.get("x-profile") or request.query_params.get("profile")
+    if flag not in ("1", "true", "yes"):
+        return False
+    require_admin(request)
+    if not _PROFILE_ID_RE.match(job_id):
+        raise HTTPException(status_code=400, detail="job_id must match [A-Za-z0-9_-]{1,64} to be profiled")
+    return True
+
+
+@router.get("/profiles/{job_id}")
+async def get_profile_endpoint(job_id: str, request: Request):
+    require_admin(request)
+    path = profile_path(job_id) if _PROFILE_ID_RE.match(job_id) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No profile for job: {job_id}")
+    media_type = "text/html" if path.suffix == ".html" else "text/plain"
+    return FileResponse(path, media_type=media_type)
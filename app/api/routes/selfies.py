@@ -0,0 +1,27 @@
+"""Prepared selfie route handler."""
+import re
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+from app.services.selfies import selfie_path
+
+router = APIRouter()
+
+_HASH_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+@router.get("/selfies/{selfie_hash}")
+async def get_selfie_endpoint(selfie_hash: str, request: Request):
+    if not _HASH_RE.match(selfie_hash):
+        raise HTTPException(status_code=404, detail="Unknown selfie")
+    path = selfie_path(selfie_hash)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Unknown selfie")
+
+    # Content-addressed, so the file behind a hash never changes
+    etag = f'"{selfie_hash}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
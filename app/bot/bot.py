@@ -2,32 +2,94 @@ import asyncio
 import os
 import sys
 from pathlib import Path
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 from loguru import logger
 
 sys.path.append(str(Path(__file__).resolve().parents[2]))
 
 from app.bot.handlers import router  # noqa: E402
+from app.bot.middlewares import ConcurrencyLimitMiddleware  # noqa: E402
+from app.config import (  # noqa: E402
+    BOT_MAX_CONCURRENT_UPDATES,
+    BOT_MODE,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+)
+from app.utils.tracing import setup_logging  # noqa: E402
+
+
+def create_dispatcher(max_concurrent_updates: Optional[int] = None) -> Dispatcher:
+    """
+    Dispatcher with the bot's handlers. max_concurrent_updates caps handlers
+    running at once; it is only used for webhook intake, where Telegram can
+    deliver updates faster than polling fetches them.
+    """
+    dp = Dispatcher(storage=MemoryStorage())
+    if max_concurrent_updates:
+        dp.update.outer_middleware(ConcurrencyLimitMiddleware(max_concurrent_updates))
+    dp.include_router(router)
+    return dp
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, secret_token: str = WEBHOOK_SECRET) -> web.Application:
+    """
+    aiohttp application that receives Telegram updates on WEBHOOK_PATH.
+
+    Requests without the matching X-Telegram-Bot-Api-Secret-Token header are
+    rejected with 401. Updates are acknowledged immediately and handled in the
+    background, so a slow map generation never blocks Telegram's delivery.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is missing in environment.")
+
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+    else:
+        logger.warning("WEBHOOK_BASE_URL is not set, skipping setWebhook")
+
+    runner = web.AppRunner(create_webhook_app(dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT).start()
+    logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
     load_dotenv()
+    setup_logging()
     token = os.getenv("BOT_TOKEN")
     if not token:
         raise RuntimeError("BOT_TOKEN is missing in environment.")
 
     bot = Bot(token=token, parse_mode=ParseMode.HTML)
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
-
-    logger.info("Starting bot...")
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        logger.info("Starting bot in webhook mode...")
+        await run_webhook(create_dispatcher(BOT_MAX_CONCURRENT_UPDATES), bot)
+    else:
+        logger.info("Starting bot...")
+        await bot.delete_webhook()
+        await create_dispatcher().start_polling(bot)
 
 
 if __name__ == "__main__":
     asyncio.run(main())
-
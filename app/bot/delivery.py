@@ -0,0 +1,70 @@
+"""Delivery of finished maps to Telegram with file_id reuse."""
+import base64
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram.types import BufferedInputFile, Message
+from loguru import logger
+
+# Telegram file_ids keyed by (map_hash, kind); kind is "preview" or "document"
+_FILE_ID_CACHE_SIZE = 1000
+_file_ids: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+def _get_file_id(map_hash: str, kind: str) -> Optional[str]:
+    key = (map_hash, kind)
+    file_id = _file_ids.get(key)
+    if file_id is not None:
+        _file_ids.move_to_end(key)
+    return file_id
+
+
+def _put_file_id(map_hash: str, kind: str, file_id: str) -> None:
+    _file_ids[(map_hash, kind)] = file_id
+    _file_ids.move_to_end((map_hash, kind))
+    while len(_file_ids) > _FILE_ID_CACHE_SIZE:
+        _file_ids.popitem(last=False)
+
+
+async def send_map(message: Message, result: dict, caption: str) -> None:
+    """
+    Send a map in two steps: a compressed JPEG preview as a photo, then the
+    full-resolution PNG as a document. Files Telegram already has for the
+    same map hash are re-sent by file_id instead of being uploaded again.
+    """
+    map_hash = result.get("map_hash") or ""
+
+    preview_id = _get_file_id(map_hash, "preview") if map_hash else None
+    preview_b64 = result.get("preview_b64")
+    if preview_id or preview_b64:
+        started = time.monotonic()
+        if preview_id:
+            sent = await message.answer_photo(photo=preview_id, caption=caption)
+        else:
+            preview_bytes = base64.b64decode(preview_b64)
+            sent = await message.answer_photo(
+                photo=BufferedInputFile(preview_bytes, filename="wish-map.jpg"),
+                caption=caption
+            )
+            logger.info(
+                f"📤 Uploaded preview: {len(preview_bytes)} bytes in {time.monotonic() - started:.1f}s"
+            )
+            if map_hash:
+                _put_file_id(map_hash, "preview", sent.photo[-1].file_id)
+        caption = "🖨 Карта в полном разрешении"
+
+    document_id = _get_file_id(map_hash, "document") if map_hash else None
+    started = time.monotonic()
+    if document_id:
+        await message.answer_document(document=document_id, caption=caption)
+        logger.info(f"📤 Re-sent map document by file_id ({map_hash[:12]})")
+    else:
+        map_bytes = base64.b64decode(result["map_b64"])
+        sent = await message.answer_document(
+            document=BufferedInputFile(map_bytes, filename="wish-map.png"),
+            caption=caption
+        )
+        logger.info(f"📤 Uploaded map document: {len(map_bytes)} bytes in {time.monotonic() - started:.1f}s")
+        if map_hash:
+            _put_file_id(map_hash, "document", sent.document.file_id)
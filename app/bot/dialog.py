@@ -7,6 +7,7 @@ class Dialog(StatesGroup):
     choosing_format = State()
     collecting_wishes = State()
     confirmation = State()
+    editing = State()
 
 
 FORMATS = {
@@ -1,22 +1,141 @@
 """Bot handlers for Wish Map Bot."""
+import asyncio
 import base64
 import os
-from typing import List
+import re
+import uuid
+from typing import Awaitable, List, Optional, Set
 
 import httpx
 from aiogram import Bot, F, Router
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
-from aiogram.types import BufferedInputFile, CallbackQuery, Message
+from aiogram.types import CallbackQuery, Message
+from loguru import logger
 
+from app.bot.delivery import send_map
 from app.bot.dialog import Dialog, format_keyboard
 from app.config import BACKEND_URL
 
 router = Router()
 
+# How long the bot waits for the backend; the backend gets a slightly smaller
+# deadline so it answers with a partial map instead of timing out.
+BACKEND_TIMEOUT = 600.0
+DEADLINE_MARGIN = 30.0
+
+# Edit commands accepted after a map is delivered
+EDIT_REPLACE_RE = re.compile(r"^(\d+)\s*[:.)]\s*(.+)$", re.S)
+EDIT_ADD_RE = re.compile(r"^\+\s*(.+)$", re.S)
+EDIT_REMOVE_RE = re.compile(r"^-\s*(\d+)$")
+
+EDIT_HELP = (
+    "Можно изменить карту — перегенерируются только изменённые картинки:\n"
+    "• «2: новый текст» — заменить желание №2\n"
+    "• «+ текст» — добавить желание\n"
+    "• «-3» — удалить желание №3\n"
+    "Когда закончишь — напиши ГОТОВО. Новая карта — /start."
+)
+
+
+# Backend calls running in the background, referenced so they are not garbage-collected
+_background: Set[asyncio.Task] = set()
+
+
+def run_in_background(coro: Awaitable[None], what: str) -> None:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+
+    def _done(done: asyncio.Task) -> None:
+        _background.discard(done)
+        if not done.cancelled() and done.exception() is not None:
+            logger.opt(exception=done.exception()).error(f"{what} failed: {done.exception()}")
+
+    task.add_done_callback(_done)
+
+
+def start_generation(message: Message, state: FSMContext, edit_of: Optional[str] = None) -> None:
+    """
+    Run trigger_generation in the background. The backend call can take
+    minutes; the handler returns at once so the update does not hold a
+    dispatcher slot and the user's /cancel is handled right away.
+    """
+    run_in_background(trigger_generation(message, state, edit_of=edit_of), "Map generation")
+
+
+async def cancel_backend(job_id: str) -> None:
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            await client.post(f"{BACKEND_URL}/api/jobs/{job_id}/cancel")
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to cancel backend job {job_id}: {e}")
+
+
+async def cancel_backend_job(state: FSMContext) -> None:
+    """Ask the backend to stop the map job and draft started from this dialog, if any."""
+    data = await state.get_data()
+    for job_id in (data.get("job_id"), data.get("draft_id")):
+        if job_id:
+            await cancel_backend(job_id)
+
+
+async def open_draft(selfie_b64: str) -> Optional[str]:
+    """
+    Open a backend draft so wishes start generating while the user types.
+    Returns None if the backend could not open it; ГОТОВО then falls back to
+    a regular /api/assemble_map call.
+    """
+    draft_id = uuid.uuid4().hex[:12]
+    payload = {"draft_id": draft_id, "selfie_b64": selfie_b64}
+    try:
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            resp = await client.post(f"{BACKEND_URL}/api/drafts", json=payload)
+            resp.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to open draft: {e}")
+        return None
+    return draft_id
+
+
+async def attach_draft(state: FSMContext, selfie_b64: str) -> None:
+    """
+    Open the draft without delaying the reply to the selfie. Wishes typed
+    before it opened are submitted once it is attached to the dialog.
+    """
+    draft_id = await open_draft(selfie_b64)
+    if not draft_id:
+        return
+    data = await state.get_data()
+    current = await state.get_state()
+    if data.get("selfie_b64") != selfie_b64 or current not in (
+        Dialog.choosing_format.state, Dialog.collecting_wishes.state
+    ):
+        # The dialog moved on (new selfie, /cancel, ГОТОВО) before the draft opened
+        await cancel_backend(draft_id)
+        return
+    await state.update_data(draft_id=draft_id)
+    data = await state.get_data()
+    for wish in data.get("wishes") or []:
+        await submit_draft_wish(state, wish)
+
+
+async def submit_draft_wish(state: FSMContext, wish: str) -> None:
+    """Start generating a wish's tile early; on failure it is generated after ГОТОВО."""
+    data = await state.get_data()
+    draft_id = data.get("draft_id")
+    if not draft_id:
+        return
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            resp = await client.post(f"{BACKEND_URL}/api/drafts/{draft_id}/wishes", json={"wish": wish})
+            resp.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to submit wish to draft {draft_id}: {e}")
+
 
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
+    await cancel_backend_job(state)
     await state.clear()
     await state.set_state(Dialog.waiting_selfie)
     await message.answer(
@@ -34,12 +153,14 @@ async def cmd_help(message: Message):
         "1. Отправь своё селфи\n"
         "2. Выбери формат карты\n"
         "3. Введи от 3 до 9 желаний (каждое отдельным сообщением)\n"
-        "4. Напиши ГОТОВО, чтобы завершить"
+        "4. Напиши ГОТОВО, чтобы завершить\n"
+        "5. После получения карты можно заменить, добавить или удалить отдельные желания"
     )
 
 
 @router.message(Command("cancel"))
 async def cmd_cancel(message: Message, state: FSMContext):
+    await cancel_backend_job(state)
     await state.clear()
     await message.answer("Диалог сброшен. Отправь /start, чтобы начать заново.")
 
@@ -54,14 +175,12 @@ async def handle_selfie(message: Message, state: FSMContext, bot: Bot):
     file_bytes = await bot.download_file(file.file_path)
     photo_data = file_bytes.read()
     
-    # Convert to base64 for storage/transmission
+    # Sent to the backend as bytes: the Telegram file URL contains the bot token
     photo_b64 = base64.b64encode(photo_data).decode()
     
-    # Get file URL (Telegram file URL)
-    photo_url = f"https://api.telegram.org/file/bot{bot.token}/{file.file_path}"
-    
-    await state.update_data(selfie_b64=photo_b64, selfie_url=photo_url)
+    await state.update_data(selfie_b64=photo_b64, draft_id=None)
     await state.set_state(Dialog.choosing_format)
+    run_in_background(attach_draft(state, photo_b64), "Opening draft")
     
     await message.answer(
         "Фото получено! Теперь выбери формат карты:",
@@ -111,7 +230,7 @@ async def handle_wish(message: Message, state: FSMContext):
             f"Отлично! Получено {len(wishes)} желаний. "
             f"Начинаю генерацию карты... Это может занять несколько минут."
         )
-        await trigger_generation(message, state)
+        start_generation(message, state)
         return
     
     data = await state.get_data()
@@ -123,6 +242,8 @@ async def handle_wish(message: Message, state: FSMContext):
     
     wishes.append(text)
     await state.update_data(wishes=wishes)
+    # Its picture starts generating now, while the next wishes are typed
+    await submit_draft_wish(state, text)
     
     remaining = 9 - len(wishes)
     if remaining > 0:
@@ -134,39 +255,137 @@ async def handle_wish(message: Message, state: FSMContext):
         await message.answer(f"Принято ({len(wishes)}/9). Напиши ГОТОВО, чтобы завершить.")
 
 
-async def trigger_generation(message: Message, state: FSMContext):
-    """Trigger map generation via backend API."""
+def format_wish_list(wishes: List[str]) -> str:
+    return "\n".join(f"{idx}. {wish}" for idx, wish in enumerate(wishes, start=1))
+
+
+@router.message(Dialog.editing, F.text)
+async def handle_edit(message: Message, state: FSMContext):
+    """Apply one edit to the delivered map's wish list, or regenerate on ГОТОВО."""
+    text = message.text.strip()
     data = await state.get_data()
-    wishes: List[str] = data.get("wishes", [])
+    wishes: List[str] = list(data.get("edit_wishes") or data.get("wishes", []))
+
+    if text.upper() == "ГОТОВО":
+        if wishes == data.get("wishes"):
+            await message.answer("Список не изменился.\n\n" + EDIT_HELP)
+            return
+        await state.set_state(Dialog.confirmation)
+        await message.answer("Обновляю карту... Перегенерирую только изменённые картинки.")
+        start_generation(message, state, edit_of=data.get("map_job_id"))
+        return
+
+    replace = EDIT_REPLACE_RE.match(text)
+    add = EDIT_ADD_RE.match(text)
+    remove = EDIT_REMOVE_RE.match(text)
+    if replace:
+        idx = int(replace.group(1)) - 1
+        if not 0 <= idx < len(wishes):
+            await message.answer(f"Нет желания №{idx + 1}.")
+            return
+        wishes[idx] = replace.group(2).strip()
+    elif add:
+        if len(wishes) >= 9:
+            await message.answer("Максимум 9 желаний. Сначала удали одно из них.")
+            return
+        wishes.append(add.group(1).strip())
+    elif remove:
+        idx = int(remove.group(1)) - 1
+        if not 0 <= idx < len(wishes):
+            await message.answer(f"Нет желания №{idx + 1}.")
+            return
+        if len(wishes) <= 3:
+            await message.answer("Нужно минимум 3 желания. Замени желание вместо удаления.")
+            return
+        wishes.pop(idx)
+    else:
+        await message.answer(EDIT_HELP)
+        return
+
+    await state.update_data(edit_wishes=wishes)
+    await message.answer(f"Новый список:\n{format_wish_list(wishes)}\n\nНапиши ГОТОВО, чтобы обновить карту.")
+
+
+async def trigger_generation(message: Message, state: FSMContext, edit_of: Optional[str] = None):
+    """
+    Trigger map generation via backend API.
+
+    With edit_of set, the edited wish list is sent to the edit endpoint of that
+    map; on failure the dialog stays in editing mode so the user can retry.
+    """
+    data = await state.get_data()
+    wishes: List[str] = data.get("edit_wishes") if edit_of else data.get("wishes", [])
     format_key = data.get("format")
-    selfie_url = data.get("selfie_url")
-    
-    if not wishes or not format_key or not selfie_url:
+    # Edits reuse the selfie the backend stored for the edited map
+    has_selfie = bool(edit_of or data.get("selfie_b64"))
+    retry_hint = "Попробуй ещё раз: напиши ГОТОВО." if edit_of else "Попробуй ещё раз /start."
+
+    if not wishes or not format_key or not has_selfie:
         await message.answer("Не хватает данных. Начни заново /start.")
         await state.clear()
         return
     
     # Show progress
     progress_msg = await message.answer("⏳ Генерирую карту... Это может занять 5-10 минут.")
-    
-    payload = {
-        "wishes": wishes,
-        "format": format_key,
-        "selfie_url": selfie_url,
-    }
+
+    job_id = uuid.uuid4().hex[:12]
+    await state.update_data(job_id=job_id)
+
+    async def still_current() -> bool:
+        # /start or /cancel while the backend was busy: the state belongs to the new dialog
+        return (await state.get_data()).get("job_id") == job_id
+
+    async def give_up() -> None:
+        if not await still_current():
+            return
+        if edit_of:
+            await state.set_state(Dialog.editing)
+        else:
+            await state.clear()
+
+    if edit_of:
+        url = f"{BACKEND_URL}/api/jobs/{edit_of}/edit"
+        payload = {
+            "job_id": job_id,
+            "wishes": wishes,
+            "format": format_key,
+            "deadline_seconds": BACKEND_TIMEOUT - DEADLINE_MARGIN,
+        }
+    elif data.get("draft_id"):
+        # Most tiles are already generated or in progress; this lays them out
+        url = f"{BACKEND_URL}/api/drafts/{data['draft_id']}/finalize"
+        payload = {
+            "job_id": job_id,
+            "wishes": wishes,
+            "format": format_key,
+            "deadline_seconds": BACKEND_TIMEOUT - DEADLINE_MARGIN,
+        }
+    else:
+        url = f"{BACKEND_URL}/api/assemble_map"
+        payload = {
+            "job_id": job_id,
+            "wishes": wishes,
+            "format": format_key,
+            "selfie_b64": data.get("selfie_b64"),
+            "deadline_seconds": BACKEND_TIMEOUT - DEADLINE_MARGIN,
+        }
     
     try:
-        async with httpx.AsyncClient(timeout=600.0) as client:  # 10 min timeout for Kolors
-            resp = await client.post(f"{BACKEND_URL}/api/assemble_map", json=payload)
+        async with httpx.AsyncClient(timeout=BACKEND_TIMEOUT) as client:
+            resp = await client.post(url, json=payload)
             resp.raise_for_status()
             result = resp.json()
     except httpx.TimeoutException:
+        if await still_current():
+            await cancel_backend_job(state)
+        else:
+            await cancel_backend(job_id)
         await progress_msg.delete()
         await message.answer(
             "⏱️ Превышено время ожидания. "
-            "Генерация может занять больше времени. Попробуй ещё раз /start."
+            f"Генерация может занять больше времени. {retry_hint}"
         )
-        await state.clear()
+        await give_up()
         return
     except httpx.HTTPStatusError as e:
         await progress_msg.delete()
@@ -176,35 +395,55 @@ async def trigger_generation(message: Message, state: FSMContext):
             error_detail = error_data.get("detail", str(e))
         except:
             error_detail = str(e)
-        await message.answer(f"❌ Ошибка при генерации: {error_detail}\nПопробуй ещё раз /start.")
-        await state.clear()
+        await message.answer(f"❌ Ошибка при генерации: {error_detail}\n{retry_hint}")
+        await give_up()
         return
     except Exception as err:
         await progress_msg.delete()
-        await message.answer(f"❌ Ошибка при генерации: {err}\nПопробуй ещё раз /start.")
-        await state.clear()
+        await message.answer(f"❌ Ошибка при генерации: {err}\n{retry_hint}")
+        await give_up()
         return
     
+    # Cancelled via /cancel or a new /start: the dialog state now belongs to them
+    if result.get("status") == "cancelled":
+        await progress_msg.delete()
+        return
+
     # Check result
     if result.get("status") != "success":
         await progress_msg.delete()
-        await message.answer("❌ Генерация не удалась. Попробуй ещё раз /start.")
-        await state.clear()
+        await message.answer(f"❌ Генерация не удалась. {retry_hint}")
+        await give_up()
         return
     
     map_b64 = result.get("map_b64")
-    if map_b64:
-        try:
-            await progress_msg.delete()
-            photo_bytes = base64.b64decode(map_b64)
-            await message.answer_photo(
-                photo=BufferedInputFile(photo_bytes, filename="wish-map.png"),
-                caption="✨ Ваша карта желаний готова!"
-            )
-        except Exception as send_err:
-            await message.answer(f"Карта сгенерирована, но не удалось отправить: {send_err}")
-    else:
+    if not map_b64:
         await progress_msg.delete()
-        await message.answer("Карта сгенерирована, но файл не получен. Попробуй ещё раз /start.")
-    
-    await state.clear()
+        await message.answer(f"Карта сгенерирована, но файл не получен. {retry_hint}")
+        await give_up()
+        return
+
+    try:
+        await progress_msg.delete()
+        caption = "✨ Карта обновлена!" if edit_of else "✨ Ваша карта желаний готова!"
+        degraded = result.get("degraded_tiles") or []
+        if edit_of:
+            regenerated = result.get("regenerated_tiles") or []
+            caption += f"\n\nПерегенерировано картинок: {len(regenerated)} из {len(wishes)}."
+        if degraded:
+            caption += f"\n\nНе успели сгенерироваться картинки: {len(degraded)} из {len(wishes)}."
+        await send_map(message, result, caption)
+    except Exception as send_err:
+        await message.answer(f"Карта сгенерирована, но не удалось отправить: {send_err}")
+
+    # Finished just as the user moved on: the map is delivered, the new dialog is kept
+    if not await still_current():
+        return
+
+    # The delivered map becomes the base for further edits
+    await state.set_state(Dialog.editing)
+    await state.update_data(
+        wishes=wishes, edit_wishes=None, map_job_id=result.get("job_id"), job_id=None, draft_id=None,
+        selfie_b64=None
+    )
+    await message.answer(EDIT_HELP)
@@ -0,0 +1,42 @@
+"""Bot middlewares."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+
+# Commands a user needs even when every slot is taken
+_PRIORITY_COMMANDS = {"/start", "/cancel", "/help"}
+
+
+def _is_priority_command(event: TelegramObject) -> bool:
+    message = event.message if isinstance(event, Update) else None
+    if not message or not message.text or not message.text.startswith("/"):
+        return False
+    # "/start@WishMapBot payload" -> "/start"
+    command = message.text.split(maxsplit=1)[0].split("@", 1)[0].lower()
+    return command in _PRIORITY_COMMANDS
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Run at most `limit` update handlers at once; the rest wait their turn.
+
+    /start, /cancel and /help bypass the limit so a user can always reset the
+    dialog, even when every slot is taken; other commands are limited as usual.
+    """
+
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if _is_priority_command(event):
+            return await handler(event, data)
+        async with self._semaphore:
+            return await handler(event, data)
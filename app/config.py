@@ -8,14 +8,59 @@ load_dotenv()
 # Kolors API Configuration
 KOLORS_API_URL = os.getenv("KOLORS_API_URL", "https://api.gen-api.ru/api/v1/networks/kling-image")
 KOLORS_API_KEY = os.getenv("KOLORS_API_KEY", "")
+# Shared across all workers; 0 disables the limit
+KOLORS_RATE_LIMIT_PER_MIN = float(os.getenv("KOLORS_RATE_LIMIT_PER_MIN", "0"))
+# Give up polling a task after this long (the original 120 polls x 2 s)
+KOLORS_POLL_TIMEOUT_SECONDS = float(os.getenv("KOLORS_POLL_TIMEOUT_SECONDS", "240"))
+# Consecutive failed status polls (errors, non-200) after which a task is given up
+KOLORS_POLL_MAX_ERRORS = int(os.getenv("KOLORS_POLL_MAX_ERRORS", "5"))
+# A generation running longer than this many times the p95 (or KOLORS_SLOW_AFTER_SECONDS
+# before there is a p95) counts as a failure for the circuit breaker
+KOLORS_SLOW_FACTOR = float(os.getenv("KOLORS_SLOW_FACTOR", "3"))
+KOLORS_SLOW_AFTER_SECONDS = float(os.getenv("KOLORS_SLOW_AFTER_SECONDS", "120"))
+# Retries of transient submit errors (network, 429, 5xx), with exponential backoff
+KOLORS_SUBMIT_RETRIES = int(os.getenv("KOLORS_SUBMIT_RETRIES", "3"))
+KOLORS_RETRY_BASE_DELAY = float(os.getenv("KOLORS_RETRY_BASE_DELAY", "1.0"))
+# Send a duplicate task when one runs longer than the observed p95 (doubles cost for slow tasks)
+KOLORS_HEDGE_ENABLED = os.getenv("KOLORS_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Circuit breaker: open when BREAKER_FAILURE_RATIO of the last BREAKER_WINDOW
+# generations failed (at least BREAKER_MIN_CALLS of them), probe again after the cooldown
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+# Endpoint template for cancelling a Kolors task, e.g. ".../tasks/{request_id}/cancel"; empty if unsupported
+KOLORS_CANCEL_URL = os.getenv("KOLORS_CANCEL_URL", "")
 
 # Backend Configuration
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 BACKEND_HOST = os.getenv("BACKEND_HOST", "0.0.0.0")
 BACKEND_PORT = int(os.getenv("BACKEND_PORT", "8000"))
+# More than one worker switches to production mode (no auto-reload)
+BACKEND_WORKERS = int(os.getenv("BACKEND_WORKERS", "1"))
+BACKEND_RELOAD = os.getenv("BACKEND_RELOAD", "true").lower() in ("1", "true", "yes")
 
 # Bot Configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+# "polling" (default) or "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Handlers allowed to run at once; further updates wait for a free slot
+BOT_MAX_CONCURRENT_UPDATES = int(os.getenv("BOT_MAX_CONCURRENT_UPDATES", "100"))
+
+# Webhook Configuration (BOT_MODE=webhook)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # public https URL; empty skips setWebhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Logging Configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+# Fraction of jobs whose INFO/DEBUG records are kept; warnings are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Dump Kolors payloads and response bodies (redacted) at DEBUG level
+LOG_DEBUG_PAYLOADS = os.getenv("LOG_DEBUG_PAYLOADS", "false").lower() in ("1", "true", "yes")
 
 # Storage Configuration
 BASE_DIR = Path(__file__).resolve().parent
@@ -26,4 +71,65 @@ TMP_DIR.mkdir(exist_ok=True)
 IMAGES_DIR = BASE_DIR / "images"
 IMAGES_DIR.mkdir(exist_ok=True)
 
+# Prepared selfies, served to Kolors from /api/selfies/{hash}
+SELFIES_DIR = IMAGES_DIR / "selfies"
+SELFIES_DIR.mkdir(exist_ok=True)
+SELFIE_MAX_SIDE = int(os.getenv("SELFIE_MAX_SIDE", "768"))
+# Public base URL of this backend as seen by Kolors; without it the prepared
+# selfie is sent to Kolors inline as base64
+SELFIE_PUBLIC_BASE_URL = os.getenv("SELFIE_PUBLIC_BASE_URL", "")
+
+# Estimated peak memory all concurrent renders of one worker may use
+RENDER_MEMORY_BUDGET_MB = int(os.getenv("RENDER_MEMORY_BUDGET_MB", "512"))
+
+# JPEG preview sent to Telegram as a photo before the full-resolution document
+PREVIEW_MAX_SIDE = int(os.getenv("PREVIEW_MAX_SIDE", "1920"))
+PREVIEW_MAX_BYTES = int(os.getenv("PREVIEW_MAX_BYTES", str(1024 * 1024)))
+
+# Tiles of one map generated in parallel
+TILE_CONCURRENCY = int(os.getenv("TILE_CONCURRENCY", "4"))
+# Part of a request deadline kept for rendering and encoding the map
+RENDER_RESERVE_SECONDS = float(os.getenv("RENDER_RESERVE_SECONDS", "15"))
+
+# Shared state (jobs, tile cache index, rate limits) for all backend workers
+STATE_DB_PATH = Path(os.getenv("STATE_DB_PATH", str(BASE_DIR / "state.db")))
+TILE_CACHE_TTL_HOURS = float(os.getenv("TILE_CACHE_TTL_HOURS", "72"))
+# Jobs, maps in TMP_DIR and prepared selfies older than this are deleted by the
+# periodic cleanup, together with expired tiles
+JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", "72"))
+CLEANUP_INTERVAL_SECONDS = float(os.getenv("CLEANUP_INTERVAL_SECONDS", "1800"))
+# How often a running job checks the shared store for a cancel from another worker
+JOB_CANCEL_POLL_SECONDS = float(os.getenv("JOB_CANCEL_POLL_SECONDS", "1.0"))
+
+
+
+# Outbound HTTP pool shared by Kolors calls and image downloads (per worker)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+
+# Readiness: minimum free space in TMP_DIR and how often Kolors reachability is re-checked
+READY_MIN_FREE_DISK_MB = int(os.getenv("READY_MIN_FREE_DISK_MB", "500"))
+READY_PROBE_INTERVAL_SECONDS = float(os.getenv("READY_PROBE_INTERVAL_SECONDS", "15"))
+
+# Batch lane (/api/batch): maps rendered at once and tiles per map. Batch work
+# yields to interactive jobs on any worker, but a batch step never waits longer
+# than BATCH_MAX_WAIT_SECONDS, so batches keep moving under steady bot traffic.
+# Interactive jobs not updated for BATCH_STALE_JOB_SECONDS are treated as stalled.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "1"))
+BATCH_TILE_CONCURRENCY = int(os.getenv("BATCH_TILE_CONCURRENCY", "2"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_YIELD_POLL_SECONDS = float(os.getenv("BATCH_YIELD_POLL_SECONDS", "0.5"))
+BATCH_MAX_WAIT_SECONDS = float(os.getenv("BATCH_MAX_WAIT_SECONDS", "30"))
+BATCH_STALE_JOB_SECONDS = float(os.getenv("BATCH_STALE_JOB_SECONDS", "300"))
+# Price of one Kolors image, used for the cost reported by batches (0 disables)
+KOLORS_COST_PER_IMAGE = float(os.getenv("KOLORS_COST_PER_IMAGE", "0"))
+
+# Admin key for debug endpoints such as request profiling; empty disables them
+ADMIN_KEY = os.getenv("ADMIN_KEY", "")
+PROFILES_DIR = TMP_DIR / "profiles"
+# Sampling interval of the built-in profiler (used when pyinstrument is not installed)
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
 
+# Draft maps (/api/drafts): what happens to tiles of wishes left out when a
+# draft is finalized - cancelled, or left to finish into the tile cache
+DRAFT_CANCEL_DROPPED = os.getenv("DRAFT_CANCEL_DROPPED", "true").lower() in ("1", "true", "yes")
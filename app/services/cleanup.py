@@ -0,0 +1,64 @@
+"""Periodic removal of expired tiles, old jobs and their files."""
+import asyncio
+import time
+from pathlib import Path
+from typing import Iterable
+
+from loguru import logger
+
+from app.config import CLEANUP_INTERVAL_SECONDS, JOB_RETENTION_HOURS, SELFIES_DIR, TMP_DIR
+from app.services.job_store import get_store
+
+
+def _remove(paths: Iterable[Path]) -> int:
+    removed = 0
+    for path in paths:
+        try:
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove {path}: {e}")
+    return removed
+
+
+def _remove_older(directory: Path, min_mtime: float) -> int:
+    """Remove files under directory last modified before min_mtime."""
+    old = []
+    for path in directory.rglob("*"):
+        try:
+            if path.is_file() and path.stat().st_mtime < min_mtime:
+                old.append(path)
+        except FileNotFoundError:
+            continue
+    return _remove(old)
+
+
+async def cleanup_once() -> None:
+    """
+    Delete expired tile cache entries with their files, jobs older than
+    JOB_RETENTION_HOURS, and maps, previews, profiles and prepared selfies
+    not touched for as long.
+
+    Safe to run from several workers at once.
+    """
+    store = get_store()
+    cutoff = time.time() - JOB_RETENTION_HOURS * 3600
+    tile_paths = store.prune_tiles()
+    jobs = store.prune_jobs(cutoff)
+    tiles = await asyncio.to_thread(_remove, tile_paths)
+    files = await asyncio.to_thread(_remove_older, TMP_DIR, cutoff)
+    selfies = await asyncio.to_thread(_remove_older, SELFIES_DIR, cutoff)
+    if tiles or jobs or files or selfies:
+        logger.info(f"🧹 Cleanup: {tiles} tiles, {jobs} jobs, {files} files, {selfies} selfies removed")
+
+
+async def cleanup_loop() -> None:
+    """Run cleanup_once every CLEANUP_INTERVAL_SECONDS, starting right away."""
+    while True:
+        try:
+            await cleanup_once()
+        except Exception as e:
+            logger.opt(exception=True).error(f"❌ Cleanup failed: {e}")
+        await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
@@ -0,0 +1,96 @@
+"""Speculative tile generation for maps whose wishes are still being typed.
+
+A draft is a job in the "draft" state that knows the selfie but not yet the
+final wish list or format. Every wish added to it starts generating right
+away; the finished tiles land in the tile cache, and tiles still running when
+the draft is finalized are joined by the final map instead of being
+requested from Kolors again.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import DRAFT_CANCEL_DROPPED, JOB_CANCEL_POLL_SECONDS, TILE_CONCURRENCY
+from app.services.job_runner import detach
+from app.services.job_store import get_store
+from app.services.map_assembler import TILE_DECODE_SIDE
+from app.services.map_pipeline import generate_tile
+
+
+@dataclass
+class _DraftTasks:
+    semaphore: asyncio.Semaphore = field(default_factory=lambda: asyncio.Semaphore(TILE_CONCURRENCY))
+    # Generation per wish text, while it runs
+    tasks: Dict[str, asyncio.Task] = field(default_factory=dict)
+    watcher: Optional[asyncio.Task] = None
+    released: bool = False
+
+
+# Drafts with tiles generating in this worker
+_drafts: Dict[str, _DraftTasks] = {}
+
+
+async def _watch_draft(draft_id: str, draft: _DraftTasks) -> None:
+    """
+    Follow the draft's status in the shared store while its tiles generate
+    here: a cancel or finalize served by another worker reaches them too.
+    """
+    store = get_store()
+    while draft.tasks:
+        await asyncio.sleep(JOB_CANCEL_POLL_SECONDS)
+        job = store.get_job(draft_id)
+        if job is None or job.status == "cancelled":
+            for task in list(draft.tasks.values()):
+                task.cancel()
+            return
+        if job.status == "finalized":
+            # Finalizing stores the final wish list on the draft
+            release_dropped(draft_id, job.wishes)
+            return
+
+
+def submit_wish(draft_id: str, idx: int, wish: str, reference_url: str, selfie_hash: str) -> None:
+    """Start generating the tile of one wish in the background."""
+    draft = _drafts.setdefault(draft_id, _DraftTasks())
+    if wish in draft.tasks:
+        return
+    if draft.watcher is None or draft.watcher.done():
+        draft.watcher = asyncio.create_task(_watch_draft(draft_id, draft))
+
+    async def run() -> None:
+        async with draft.semaphore:
+            # Tiles are square whatever the format; the size only matters for placeholders
+            await generate_tile(draft_id, idx, wish, reference_url, selfie_hash, TILE_DECODE_SIDE, TILE_DECODE_SIDE)
+
+    task = asyncio.create_task(run())
+    draft.tasks[wish] = task
+    detach(draft_id, task)
+
+    def _forget(done: asyncio.Task) -> None:
+        if draft.tasks.get(wish) is done:
+            del draft.tasks[wish]
+        if not draft.tasks and _drafts.get(draft_id) is draft:
+            del _drafts[draft_id]
+
+    task.add_done_callback(_forget)
+    logger.info(f"🔮 Speculative tile {idx+1} started: {wish}")
+
+
+def release_dropped(draft_id: str, final_wishes: List[str]) -> None:
+    """
+    Deal with tiles of wishes that did not make it into the final map: cancel
+    them (DRAFT_CANCEL_DROPPED) or let them finish into the tile cache.
+    """
+    draft = _drafts.get(draft_id)
+    if draft is None or draft.released:
+        return
+    draft.released = True
+    dropped = [wish for wish in draft.tasks if wish not in final_wishes]
+    for wish in dropped:
+        if DRAFT_CANCEL_DROPPED:
+            draft.tasks[wish].cancel()
+    if dropped:
+        action = "cancelled" if DRAFT_CANCEL_DROPPED else "parked in the tile cache"
+        logger.info(f"🔮 Draft {draft_id}: {len(dropped)} dropped tiles {action}")
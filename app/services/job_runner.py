@@ -0,0 +1,151 @@
+"""Cancellable execution of map jobs across worker processes."""
+import asyncio
+import time
+from typing import Awaitable, Dict, Optional, Set, TypeVar
+
+from loguru import logger
+
+from app.config import (
+    BATCH_MAX_WAIT_SECONDS,
+    BATCH_STALE_JOB_SECONDS,
+    BATCH_YIELD_POLL_SECONDS,
+    JOB_CANCEL_POLL_SECONDS,
+)
+from app.services.job_store import get_store
+from app.utils import metrics
+
+T = TypeVar("T")
+
+# Jobs running in this worker process
+_running: Dict[str, asyncio.Task] = {}
+_cancelled: Set[str] = set()
+# Subset of _running started by users waiting for the answer; batch jobs yield to them
+_interactive: Set[str] = set()
+# Work a job left running after it answered (e.g. tiles past the deadline)
+_detached: Dict[str, Set[asyncio.Task]] = {}
+
+
+class JobCancelled(Exception):
+    """Raised by run_job when the job was cancelled by the client."""
+
+
+async def _watch_for_cancel(job_id: str, task: asyncio.Task) -> None:
+    """Cancel task once another worker marks the job as cancelled in the store."""
+    store = get_store()
+    while not task.done():
+        await asyncio.sleep(JOB_CANCEL_POLL_SECONDS)
+        job = store.get_job(job_id)
+        if job is not None and job.status == "cancelled":
+            _cancelled.add(job_id)
+            task.cancel()
+            return
+
+
+async def run_job(job_id: str, coro: Awaitable[T], interactive: bool = True) -> T:
+    """
+    Run a job so that cancel_job can stop it from any worker.
+
+    Cancellation is delivered as asyncio.CancelledError inside the job, so
+    Kolors polling, downloads and rendering stop at their next await.
+    Batch jobs pass interactive=False so they do not hold back each other.
+
+    Raises:
+        JobCancelled: if the job was cancelled before it finished
+    """
+    job = get_store().get_job(job_id)
+    if job is not None and job.status == "cancelled":
+        # Cancelled before it got here, e.g. through another worker
+        if asyncio.iscoroutine(coro):
+            coro.close()
+        raise JobCancelled(job_id)
+
+    task = asyncio.ensure_future(coro)
+    _running[job_id] = task
+    if interactive:
+        _interactive.add(job_id)
+    watcher = asyncio.create_task(_watch_for_cancel(job_id, task))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if job_id in _cancelled:
+            raise JobCancelled(job_id)
+        # The request itself was cancelled: stop the job too
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+        _running.pop(job_id, None)
+        _interactive.discard(job_id)
+        _cancelled.discard(job_id)
+
+
+def running_jobs() -> int:
+    """Number of jobs currently running in this worker process."""
+    return len(_running)
+
+
+def _interactive_busy() -> bool:
+    """Whether interactive jobs or drafts are in progress on any worker."""
+    if _interactive:
+        return True
+    since = time.time() - BATCH_STALE_JOB_SECONDS
+    return get_store().count_active("interactive", since) > 0
+
+
+async def wait_for_batch_turn() -> None:
+    """
+    Hold a batch step back while interactive work is in progress.
+
+    The wait is capped at BATCH_MAX_WAIT_SECONDS: a step that waited that long
+    runs anyway, so the batch lane keeps a minimum share under steady traffic.
+    """
+    started = time.monotonic()
+    while _interactive_busy():
+        if time.monotonic() - started >= BATCH_MAX_WAIT_SECONDS:
+            metrics.inc("batch_aged_steps_total")
+            logger.debug("⏳ Batch step waited too long, running it next to interactive jobs")
+            return
+        await asyncio.sleep(BATCH_YIELD_POLL_SECONDS)
+
+
+def detach(job_id: str, task: asyncio.Task) -> None:
+    """Let a task outlive its job's request; cancel_job still stops it."""
+    tasks = _detached.setdefault(job_id, set())
+    tasks.add(task)
+
+    def _forget(done: asyncio.Task) -> None:
+        tasks.discard(done)
+        if not tasks:
+            _detached.pop(job_id, None)
+
+    task.add_done_callback(_forget)
+
+
+def cancel_job(job_id: str) -> Optional[str]:
+    """
+    Cancel a job unless it has already finished.
+
+    Returns the job's status after the call ("cancelled", or the status it
+    finished with), or None if the job is unknown. Work a finished job left
+    running in the background is stopped either way.
+    """
+    store = get_store()
+    job = store.get_job(job_id)
+    task = _running.get(job_id)
+    detached = _detached.get(job_id, set())
+    if job is None and task is None and not detached:
+        return None
+
+    for background in list(detached):
+        background.cancel()
+    if job is not None and job.status not in ("running", "draft", "cancelled"):
+        logger.info(f"🛑 Cancel requested for job {job_id}, which is already {job.status}")
+        return job.status
+
+    if job is not None and job.status != "cancelled":
+        store.update_job(job_id, status="cancelled")
+    if task is not None and not task.done():
+        _cancelled.add(job_id)
+        task.cancel()
+    logger.info(f"🛑 Cancel requested for job {job_id}")
+    return "cancelled"
@@ -0,0 +1,250 @@
+"""Shared job state, tile cache index and rate-limit buckets.
+
+Backed by a single SQLite database in WAL mode so that every uvicorn worker
+process sees the same state: any worker can answer a status request for a job
+rendered by another one, and tiles generated by one worker are reused by all.
+"""
+import json
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from app.config import STATE_DB_PATH, TILE_CACHE_TTL_HOURS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    format TEXT NOT NULL,
+    wishes TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result_path TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    selfie_hash TEXT,
+    reference_url TEXT,
+    lane TEXT NOT NULL DEFAULT 'interactive'
+);
+CREATE TABLE IF NOT EXISTS tiles (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Columns added after the first release, created on databases that predate them
+_JOB_COLUMNS_ADDED = {
+    "selfie_hash": "TEXT",
+    "reference_url": "TEXT",
+    "lane": "TEXT NOT NULL DEFAULT 'interactive'",
+}
+
+
+@dataclass
+class JobRecord:
+    job_id: str
+    status: str
+    format: str
+    wishes: List[str]
+    total: int
+    done: int
+    result_path: Optional[str]
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+    selfie_hash: Optional[str] = None
+    reference_url: Optional[str] = None
+    lane: str = "interactive"  # "interactive" or "batch"
+
+
+@dataclass
+class TileRecord:
+    key: str
+    url: str
+    path: Path
+
+
+class JobStore:
+    """Process-safe store shared by all backend workers."""
+
+    def __init__(self, db_path: Path = STATE_DB_PATH):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode: every statement is its own transaction unless
+        # wrapped in an explicit BEGIN, which keeps writer locks short.
+        self._conn = sqlite3.connect(
+            str(self.db_path), timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        logger.info(f"🗄 Job store opened: {self.db_path}")
+
+    def _migrate(self) -> None:
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in _JOB_COLUMNS_ADDED.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+
+    # Jobs
+
+    def create_job(
+        self,
+        job_id: str,
+        format_key: str,
+        wishes: List[str],
+        selfie_hash: Optional[str] = None,
+        reference_url: Optional[str] = None,
+        status: str = "running",
+        lane: str = "interactive",
+    ) -> None:
+        """
+        Create the job, or update the one registered earlier under the same id.
+
+        A job that was cancelled stays cancelled, so a cancel that arrives
+        before the job is fully set up is not lost.
+        """
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO jobs (job_id, status, format, wishes, total, done, created_at, updated_at, "
+            "selfie_hash, reference_url, lane) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET "
+            "status = CASE WHEN jobs.status = 'cancelled' THEN 'cancelled' ELSE excluded.status END, "
+            "format = excluded.format, wishes = excluded.wishes, total = excluded.total, "
+            "updated_at = excluded.updated_at, "
+            "selfie_hash = COALESCE(excluded.selfie_hash, jobs.selfie_hash), "
+            "reference_url = COALESCE(excluded.reference_url, jobs.reference_url)",
+            (job_id, status, format_key, json.dumps(wishes, ensure_ascii=False), len(wishes), now, now,
+             selfie_hash, reference_url, lane),
+        )
+
+    def update_job(self, job_id: str, **fields: Any) -> None:
+        if not fields:
+            return
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        self._conn.execute(
+            f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id)
+        )
+
+    def set_wishes(self, job_id: str, wishes: List[str]) -> None:
+        self.update_job(job_id, wishes=json.dumps(wishes, ensure_ascii=False), total=len(wishes))
+
+    def increment_done(self, job_id: str) -> None:
+        self._conn.execute(
+            "UPDATE jobs SET done = done + 1, updated_at = ? WHERE job_id = ?", (time.time(), job_id)
+        )
+
+    def get_job(self, job_id: str) -> Optional[JobRecord]:
+        row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        data: Dict[str, Any] = dict(row)
+        data["wishes"] = json.loads(data["wishes"])
+        return JobRecord(**data)
+
+    def prune_jobs(self, min_updated: float) -> int:
+        """Delete jobs not updated since min_updated; returns how many were deleted."""
+        return self._conn.execute("DELETE FROM jobs WHERE updated_at < ?", (min_updated,)).rowcount
+
+    def count_active(self, lane: str, since: float) -> int:
+        """Running jobs and open drafts of a lane, on any worker, updated after since."""
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE lane = ? AND status IN ('running', 'draft') AND updated_at >= ?",
+            (lane, since),
+        ).fetchone()
+        return row[0]
+
+    # Tile cache
+
+    def get_tile(self, key: str) -> Optional[TileRecord]:
+        min_created = time.time() - TILE_CACHE_TTL_HOURS * 3600
+        row = self._conn.execute(
+            "SELECT key, url, path FROM tiles WHERE key = ? AND created_at >= ?", (key, min_created)
+        ).fetchone()
+        if row is None:
+            return None
+        path = Path(row["path"])
+        if not path.exists():
+            self._conn.execute("DELETE FROM tiles WHERE key = ?", (key,))
+            return None
+        return TileRecord(key=row["key"], url=row["url"], path=path)
+
+    def prune_tiles(self) -> List[Path]:
+        """
+        Delete tiles past TILE_CACHE_TTL_HOURS.
+
+        Returns their files that no remaining tile refers to; the caller
+        deletes them.
+        """
+        min_created = time.time() - TILE_CACHE_TTL_HOURS * 3600
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            rows = self._conn.execute(
+                "SELECT DISTINCT path FROM tiles WHERE created_at < ?", (min_created,)
+            ).fetchall()
+            self._conn.execute("DELETE FROM tiles WHERE created_at < ?", (min_created,))
+            return [
+                Path(row["path"]) for row in rows
+                if self._conn.execute("SELECT 1 FROM tiles WHERE path = ?", (row["path"],)).fetchone() is None
+            ]
+
+    def put_tile(self, key: str, url: str, path: Path) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO tiles (key, url, path, created_at) VALUES (?, ?, ?, ?)",
+            (key, url, str(path), time.time()),
+        )
+
+    # Rate limiting
+
+    def try_acquire(self, name: str, rate_per_sec: float, capacity: float) -> float:
+        """
+        Take one token from a shared token bucket.
+
+        Returns 0 if a token was taken, otherwise the number of seconds to wait
+        before the next token becomes available.
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute(
+                "SELECT tokens, updated_at FROM rate_limits WHERE name = ?", (name,)
+            ).fetchone()
+            tokens = capacity if row is None else min(
+                capacity, row["tokens"] + (now - row["updated_at"]) * rate_per_sec
+            )
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate_per_sec
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)",
+                (name, tokens, now),
+            )
+        return wait
+
+
+# Singleton instance
+_store: Optional[JobStore] = None
+
+
+def get_store() -> JobStore:
+    global _store
+    if _store is None:
+        _store = JobStore()
+    return _store
@@ -1,9 +1,50 @@
 import asyncio
+import random
+import time
 import httpx
-from typing import Optional
+from dataclasses import dataclass
+from typing import Callable, Optional
 from loguru import logger
 
-from app.config import KOLORS_API_URL, KOLORS_API_KEY
+from app.config import (
+    BREAKER_COOLDOWN_SECONDS,
+    BREAKER_FAILURE_RATIO,
+    BREAKER_MIN_CALLS,
+    BREAKER_WINDOW,
+    KOLORS_API_KEY,
+    KOLORS_API_URL,
+    KOLORS_CANCEL_URL,
+    KOLORS_HEDGE_ENABLED,
+    KOLORS_POLL_MAX_ERRORS,
+    KOLORS_POLL_TIMEOUT_SECONDS,
+    KOLORS_RATE_LIMIT_PER_MIN,
+    KOLORS_RETRY_BASE_DELAY,
+    KOLORS_SLOW_AFTER_SECONDS,
+    KOLORS_SLOW_FACTOR,
+    KOLORS_SUBMIT_RETRIES,
+    LOG_DEBUG_PAYLOADS,
+)
+from app.services.job_store import get_store
+from app.services.kolors_resilience import CircuitBreaker, LatencyTracker
+from app.utils import metrics
+from app.utils.http import get_http_client
+from app.utils.tracing import redact, span
+
+
+class KolorsError(Exception):
+    """Kolors rejected or failed a request."""
+
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message)
+        # Transient errors (network, 429, 5xx) are worth retrying
+        self.transient = transient
+
+
+@dataclass
+class SubmittedTask:
+    request_id: Optional[str] = None
+    # Some responses carry the finished image right away
+    direct_url: Optional[str] = None
 
 
 class KolorsClient:
@@ -12,62 +53,132 @@ class KolorsClient:
     def __init__(self):
         self.api_url = KOLORS_API_URL
         self.api_key = KOLORS_API_KEY
+        self.breaker = CircuitBreaker(
+            "kolors",
+            window=BREAKER_WINDOW,
+            min_calls=BREAKER_MIN_CALLS,
+            failure_ratio=BREAKER_FAILURE_RATIO,
+            cooldown=BREAKER_COOLDOWN_SECONDS,
+        )
+        self.latency = LatencyTracker("kolors_generate")
 
-    async def _poll_result(self, request_id, timeout: int = 120) -> Optional[str]:
-        """Poll Kolors API until the image is ready."""
-        status_url = f"https://api.gen-api.ru/api/v1/tasks/{request_id}"
-        logger.info(f"🔄 Polling task result: {status_url}")
-
-        headers = {
+    def _headers(self) -> dict:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            for attempt in range(timeout):
-                await asyncio.sleep(2)
-
-                try:
-                    resp = await client.get(status_url, headers=headers)
-                    logger.debug(f"⬅️ Kolors poll response {resp.status_code}: {resp.text}")
-
-                    if resp.status_code != 200:
-                        continue
-
-                    data = resp.json()
-
-                    if data.get("status") == "success" or data.get("status") == "completed":
-                        # Try multiple possible response structures
-                        output = data.get("output") or data.get("data") or data.get("result") or {}
-                        
-                        # Extract URL from various possible structures
-                        url = None
-                        if isinstance(output, dict):
-                            url = output.get("url") or output.get("image_url")
-                        elif isinstance(output, list) and len(output) > 0:
-                            url = output[0].get("url") or output[0].get("image_url")
-                        
-                        if not url:
-                            url = data.get("url") or data.get("image_url")
-                        
-                        if url:
-                            logger.info(f"✅ Image URL ready: {url}")
-                            return url
-                        logger.warning(f"Status is success but no URL found. Response: {data}")
-
-                    if data.get("status") == "error":
-                        logger.error(f"❌ Kolors error during polling: {data}")
-                        return None
-
-                except Exception as e:
-                    logger.error(f"Polling error: {e}")
-                    continue
+    async def _acquire_submit_slot(self) -> None:
+        """Wait for a token from the rate limit shared by all workers (if configured)."""
+        if KOLORS_RATE_LIMIT_PER_MIN <= 0:
+            return
+        rate = KOLORS_RATE_LIMIT_PER_MIN / 60
+        # Allow bursts of up to 10 seconds worth of requests
+        capacity = max(1.0, rate * 10)
+        while True:
+            wait = get_store().try_acquire("kolors_submit", rate, capacity)
+            if wait <= 0:
+                return
+            logger.info(f"⏳ Kolors rate limit reached, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+    async def _cancel_task(self, client: httpx.AsyncClient, request_id) -> None:
+        """Best-effort cancel of a Kolors task; a no-op unless KOLORS_CANCEL_URL is set."""
+        if not KOLORS_CANCEL_URL:
+            return
+        try:
+            resp = await client.post(
+                KOLORS_CANCEL_URL.format(request_id=request_id),
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=5.0,
+            )
+            logger.info(f"🛑 Kolors task {request_id} cancel: {resp.status_code}")
+        except Exception as e:
+            logger.warning(f"Failed to cancel Kolors task {request_id}: {e}")
+
+    async def _poll_result(
+        self,
+        client: httpx.AsyncClient,
+        request_id,
+        abort: Optional[Callable[[], bool]] = None,
+    ) -> Optional[str]:
+        """
+        Poll Kolors API until the image is ready, the timeout passes or abort() is true.
+
+        Gives up after KOLORS_POLL_MAX_ERRORS failed polls in a row, so a
+        degraded status API fails the tile in seconds rather than at the timeout.
+        """
+        status_url = f"https://api.gen-api.ru/api/v1/tasks/{request_id}"
+        logger.info(f"🔄 Polling task result: {status_url}")
+
+        started = time.monotonic()
+        attempt = 0
+        errors = 0
+        while time.monotonic() - started < KOLORS_POLL_TIMEOUT_SECONDS:
+            await asyncio.sleep(2)
+            attempt += 1
+
+            if abort is not None and abort():
+                logger.warning(f"⏹ Polling aborted (request_id={request_id})")
+                return None
+
+            try:
+                resp = await client.get(status_url, headers=self._headers(), timeout=10.0)
+                if LOG_DEBUG_PAYLOADS:
+                    logger.opt(lazy=True).debug(
+                        "⬅️ Kolors poll response {}: {}", lambda: resp.status_code, lambda: redact(resp.text)
+                    )
+
+                if resp.status_code != 200:
+                    raise KolorsError(f"status poll returned {resp.status_code}")
+
+                data = resp.json()
+                errors = 0
+
+                if data.get("status") == "success" or data.get("status") == "completed":
+                    # Try multiple possible response structures
+                    output = data.get("output") or data.get("data") or data.get("result") or {}
+
+                    # Extract URL from various possible structures
+                    url = None
+                    if isinstance(output, dict):
+                        url = output.get("url") or output.get("image_url")
+                    elif isinstance(output, list) and len(output) > 0:
+                        url = output[0].get("url") or output[0].get("image_url")
+
+                    if not url:
+                        url = data.get("url") or data.get("image_url")
+
+                    if url:
+                        logger.info(f"✅ Image URL ready after {attempt} polls: {url}")
+                        return url
+                    logger.warning(f"Status is success but no URL found (request_id={request_id})")
+
+                if data.get("status") == "error":
+                    logger.error(f"❌ Kolors error during polling (request_id={request_id})")
+                    if LOG_DEBUG_PAYLOADS:
+                        logger.opt(lazy=True).debug("⬅️ Kolors error body: {}", lambda: redact(data))
+                    return None
+
+            except Exception as e:
+                errors += 1
+                logger.warning(f"Polling error {errors}/{KOLORS_POLL_MAX_ERRORS}: {e}")
+                if errors >= KOLORS_POLL_MAX_ERRORS:
+                    logger.error(f"❌ Giving up on task after {errors} failed polls (request_id={request_id})")
+                    metrics.inc("kolors_poll_failures_total")
+                    return None
+                continue
 
         logger.error("❌ Polling timeout — Kolors did not return an image in time")
         return None
 
-    async def generate_image(self, prompt: str, photo_url: str, aspect_ratio: str) -> Optional[str]:
-        """Send generation request to Kolors API and poll for the result."""
+    async def submit_task(self, prompt: str, photo_url: str, aspect_ratio: str) -> SubmittedTask:
+        """
+        Send a generation request to Kolors.
+
+        Raises:
+            KolorsError: if the request failed; `transient` tells whether to retry
+        """
 
         # Kolors API может принимать image как строку URL или как объект
         # Попробуем сначала как строку (более простой вариант)
@@ -79,76 +190,84 @@ class KolorsClient:
                 "ugly, distorted face, deformed body, extra limbs, bad anatomy, "
                 "low quality, plastic skin, cartoonish, AI-looking, weird eyes"
             ),
-            "image": photo_url,  # Просто URL строка
+            "image": photo_url,  # URL или base64 подготовленного селфи
             "model": "kling-v1",
             "image_fidelity": 1,
             "aspect_ratio": aspect_ratio,
             "n": 1
         }
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
-        # FULL LOGGING BEFORE REQUEST
-        logger.warning("🚀 SENDING REQUEST TO KOLORS")
-        logger.warning(f"➡️ API URL: {self.api_url}")
-        logger.warning(f"➡️ HEADERS: {headers}")
-        logger.warning(f"➡️ PAYLOAD: {payload}")
-        logger.warning(f"➡️ PHOTO_URL: {photo_url}")
+        await self._acquire_submit_slot()
 
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            try:
-                resp = await client.post(self.api_url, json=payload, headers=headers)
-
-                logger.warning(f"⬅️ RAW RESPONSE STATUS: {resp.status_code}")
-                logger.warning(f"⬅️ RAW RESPONSE BODY: {resp.text}")
-
-                if resp.status_code != 200:
-                    logger.error(f"❌ Kolors request failed: {resp.text}")
-                    return None
+        logger.info(f"🚀 Sending request to Kolors: {self.api_url}")
+        if LOG_DEBUG_PAYLOADS:
+            logger.opt(lazy=True).debug("➡️ HEADERS: {}", lambda: redact(self._headers()))
+            logger.opt(lazy=True).debug("➡️ PAYLOAD: {}", lambda: redact(payload))
 
-                data = resp.json()
-                
-                # Try different possible response formats
-                request_id = (
-                    data.get("request_id") or 
-                    data.get("id") or 
-                    data.get("task_id") or
-                    (data.get("data", {}).get("request_id") if isinstance(data.get("data"), dict) else None) or
-                    (data.get("result", {}).get("request_id") if isinstance(data.get("result"), dict) else None)
+        try:
+            with span("kolors.submit"):
+                resp = await get_http_client().post(
+                    self.api_url, json=payload, headers=self._headers(), timeout=60.0
                 )
+        except httpx.HTTPError as e:
+            raise KolorsError(f"POST to Kolors failed: {e}", transient=True)
+
+        logger.info(f"⬅️ Kolors response status: {resp.status_code}")
+        if LOG_DEBUG_PAYLOADS:
+            logger.opt(lazy=True).debug("⬅️ RAW RESPONSE BODY: {}", lambda: redact(resp.text))
+
+        if resp.status_code != 200:
+            raise KolorsError(
+                f"Kolors request failed with status {resp.status_code}",
+                transient=resp.status_code == 429 or resp.status_code >= 500,
+            )
+
+        try:
+            data = resp.json()
+        except ValueError:
+            raise KolorsError("Kolors returned a non-JSON response", transient=True)
+
+        # Try different possible response formats
+        request_id = (
+            data.get("request_id") or
+            data.get("id") or
+            data.get("task_id") or
+            (data.get("data", {}).get("request_id") if isinstance(data.get("data"), dict) else None) or
+            (data.get("result", {}).get("request_id") if isinstance(data.get("result"), dict) else None)
+        )
 
-                if not request_id:
-                    logger.error(f"❌ Kolors did not return request_id. Response: {data}")
-                    # Try to extract direct URL if available
-                    direct_url = None
-                    if isinstance(data.get("output"), dict):
-                        direct_url = data.get("output", {}).get("url")
-                    elif isinstance(data.get("data"), dict):
-                        direct_url = data.get("data", {}).get("url")
-                    else:
-                        direct_url = data.get("url") or data.get("image_url")
-                    
-                    if direct_url:
-                        logger.info(f"✅ Got direct URL from Kolors: {direct_url}")
-                        return direct_url
-                    return None
-
-                logger.info(f"📨 Received request_id from Kolors: {request_id}")
-                logger.info("⏳ Starting polling...")
-
-                return await self._poll_result(request_id)
-
-            except Exception as e:
-                logger.error(f"❌ Exception during POST to Kolors: {e}")
-                return None
-
-    async def generate_wish_image(self, wish_text: str, photo_url: str, width: int, height: int) -> Optional[str]:
-        """Generate 1:1 image for the wish (regardless of final map format)."""
+        if not request_id:
+            logger.error("❌ Kolors did not return request_id")
+            # Try to extract direct URL if available
+            direct_url = None
+            if isinstance(data.get("output"), dict):
+                direct_url = data.get("output", {}).get("url")
+            elif isinstance(data.get("data"), dict):
+                direct_url = data.get("data", {}).get("url")
+            else:
+                direct_url = data.get("url") or data.get("image_url")
+
+            if direct_url:
+                logger.info(f"✅ Got direct URL from Kolors: {direct_url}")
+                return SubmittedTask(direct_url=direct_url)
+            raise KolorsError("Kolors returned neither request_id nor image URL")
+
+        logger.info(f"📨 Received request_id from Kolors: {request_id}")
+        return SubmittedTask(request_id=request_id)
+
+    async def wait_for_task(self, request_id, abort: Optional[Callable[[], bool]] = None) -> Optional[str]:
+        """Poll a submitted task; cancelling the caller also cancels the Kolors task."""
+        logger.info("⏳ Starting polling...")
+        client = get_http_client()
+        with span("kolors.poll", request_id=request_id):
+            try:
+                return await self._poll_result(client, request_id, abort)
+            except asyncio.CancelledError:
+                await self._cancel_task(client, request_id)
+                raise
 
-        prompt = (
+    def build_wish_prompt(self, wish_text: str) -> str:
+        return (
             f"Generate a photorealistic scene featuring the person from the reference image. "
             f"Preserve their exact facial features, age, gender, and ethnicity. "
             f"The person should appear naturally integrated into the environment. "
@@ -156,12 +275,111 @@ class KolorsClient:
             f"Style: cinematic, natural lighting, high realism."
         )
 
+    async def _submit_with_retries(self, prompt: str, photo_url: str, aspect_ratio: str) -> SubmittedTask:
+        """Submit a task, retrying transient errors with exponential backoff and jitter."""
+        for attempt in range(KOLORS_SUBMIT_RETRIES + 1):
+            try:
+                return await self.submit_task(prompt, photo_url, aspect_ratio)
+            except KolorsError as e:
+                if not e.transient or attempt == KOLORS_SUBMIT_RETRIES or self.breaker.is_open:
+                    raise
+                delay = KOLORS_RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.0)
+                logger.warning(f"🔁 {e}; retry {attempt + 1}/{KOLORS_SUBMIT_RETRIES} in {delay:.1f}s")
+                metrics.inc("kolors_submit_retries_total")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, prompt: str, photo_url: str, aspect_ratio: str) -> Optional[str]:
+        """One submit + poll cycle; polling stops early once the breaker opens."""
+        try:
+            task = await self._submit_with_retries(prompt, photo_url, aspect_ratio)
+        except KolorsError as e:
+            logger.error(f"❌ {e}")
+            return None
+        if task.direct_url:
+            return task.direct_url
+        return await self.wait_for_task(task.request_id, abort=lambda: self.breaker.is_open)
+
+    async def _generate_hedged(self, prompt: str, photo_url: str, aspect_ratio: str) -> Optional[str]:
+        """
+        Run one attempt, and start a duplicate once it runs longer than the
+        observed p95. The first successful result wins; the other attempt is
+        cancelled, which also cancels its Kolors task.
+        """
+        hedge_after = self.latency.p95() if KOLORS_HEDGE_ENABLED and self.breaker.state == "closed" else None
+        primary = asyncio.create_task(self._attempt(prompt, photo_url, aspect_ratio))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                logger.info(f"🪞 Generation slower than p95 ({hedge_after:.0f}s), sending hedge request")
+                metrics.inc("kolors_hedges_total")
+                tasks.add(asyncio.create_task(self._attempt(prompt, photo_url, aspect_ratio)))
+
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is not None:
+                        logger.error(f"❌ Generation attempt failed: {finished.exception()}")
+                    elif finished.result():
+                        if finished is not primary:
+                            metrics.inc("kolors_hedge_wins_total")
+                        return finished.result()
+            return None
+        finally:
+            for pending in tasks:
+                pending.cancel()
+
+    async def generate_wish_image(self, wish_text: str, photo_url: str, width: int, height: int) -> Optional[str]:
+        """
+        Generate 1:1 image for the wish (regardless of final map format).
+
+        Returns None right away while the circuit breaker is open, so callers
+        fall back to placeholders within seconds instead of waiting for timeouts.
+        """
+
+        prompt = self.build_wish_prompt(wish_text)
+
         # ALWAYS 1:1 FOR INDIVIDUAL WISH IMAGES
         aspect_ratio = "1:1"
 
+        if not self.breaker.allow():
+            logger.warning(f"⚡ Kolors circuit is {self.breaker.state}, skipping '{wish_text}'")
+            metrics.inc("kolors_requests_total", outcome="short_circuited")
+            return None
+
         logger.info(f"🧠 Generating wish image with AR={aspect_ratio}, wish='{wish_text}'")
 
-        return await self.generate_image(prompt, photo_url, aspect_ratio)
+        started = time.monotonic()
+        generation = asyncio.create_task(self._generate_hedged(prompt, photo_url, aspect_ratio))
+        # A generation far past p95 already counts as a failure, so a Kolors
+        # that got slow opens the breaker before tiles hit the poll timeout
+        slow = False
+        try:
+            p95 = self.latency.p95()
+            slow_after = p95 * KOLORS_SLOW_FACTOR if p95 is not None else KOLORS_SLOW_AFTER_SECONDS
+            done, _ = await asyncio.wait({generation}, timeout=slow_after)
+            if not done:
+                slow = True
+                logger.warning(f"🐢 Generation running past {slow_after:.0f}s, counting it as a failure")
+                metrics.inc("kolors_slow_total")
+                self.breaker.record_failure()
+            url = await generation
+        except asyncio.CancelledError:
+            generation.cancel()
+            if not slow:
+                self.breaker.record_cancelled()
+            raise
+
+        if url:
+            if not slow:
+                self.breaker.record_success()
+            self.latency.observe(time.monotonic() - started)
+            metrics.inc("kolors_requests_total", outcome="success")
+        else:
+            if not slow:
+                self.breaker.record_failure()
+            metrics.inc("kolors_requests_total", outcome="failure")
+        return url
 
 
 # Singleton instance
@@ -173,4 +391,3 @@ def get_client() -> KolorsClient:
     if _client is None:
         _client = KolorsClient()
     return _client
-
@@ -0,0 +1,105 @@
+"""Circuit breaker and latency tracking for Kolors generation."""
+import time
+from collections import deque
+from typing import Deque, Optional
+
+from loguru import logger
+
+from app.utils import metrics
+
+_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitBreaker:
+    """
+    Stops calling Kolors while it is failing.
+
+    Opens when at least `min_calls` of the last `window` outcomes are known and
+    the failure ratio reaches `failure_ratio`. After `cooldown` seconds one
+    probe request is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, name: str, window: int, min_calls: int, failure_ratio: float, cooldown: float):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        metrics.set_gauge("circuit_state", 0, breaker=name)
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"⚡ Circuit '{self.name}': {self.state} -> {state}")
+        self.state = state
+        metrics.set_gauge("circuit_state", _STATE_VALUES[state], breaker=self.name)
+        if state == "open":
+            self._opened_at = time.monotonic()
+            metrics.inc("circuit_opened_total", breaker=self.name)
+        if state == "closed":
+            self._outcomes.clear()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == "open"
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+            self._set_state("half_open")
+            self._probe_in_flight = False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._probe_in_flight = False
+        if self.state == "half_open":
+            self._set_state("closed")
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        self._probe_in_flight = False
+        if self.state == "half_open":
+            self._set_state("open")
+            return
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if (
+            self.state == "closed"
+            and len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_ratio
+        ):
+            self._set_state("open")
+
+    def record_cancelled(self) -> None:
+        """A request ended without an outcome (e.g. the job was cancelled)."""
+        self._probe_in_flight = False
+
+
+class LatencyTracker:
+    """Rolling window of completion times, used to decide when to hedge."""
+
+    def __init__(self, name: str, window: int = 200, min_samples: int = 20):
+        self.name = name
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        p95 = self.p95()
+        if p95 is not None:
+            metrics.set_gauge("latency_p95_seconds", round(p95, 2), operation=self.name)
+
+    def p95(self) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
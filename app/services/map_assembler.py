@@ -1,13 +1,34 @@
 """Map assembler for creating final wish map collage."""
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from PIL import Image, ImageDraw, ImageFont
 from loguru import logger
 
-from app.utils.images import download_image, create_placeholder
+from app.services.render_scheduler import get_render_scheduler
+from app.utils.deadline import Deadline
+from app.utils.formats import FORMATS
+from app.utils.images import download_image, create_placeholder, load_font, save_preview
 from app.utils.grid import choose_grid, place_cells
 
+# Wish counts accepted by the API
+WISH_COUNTS = range(3, 10)
+# Largest tile side we expect to decode (Kolors returns 1024x1024 for 1:1)
+TILE_DECODE_SIDE = 1024
+
+
+@dataclass
+class MapLayout:
+    """Pre-computed geometry for one (size, wish count) combination."""
+    rows: int
+    cols: int
+    cell_width: int
+    cell_height: int
+    positions: List[Tuple[int, int]]  # top-left corner of each cell on the canvas
+    label_font: ImageFont.FreeTypeFont
+    label_offset_y: int  # label baseline band, relative to the cell top
+
 
 class MapAssembler:
     """Assembles generated images into a final wish map."""
@@ -17,26 +38,104 @@ class MapAssembler:
         self.margin = 40
         self.padding = 20
         self.title_height = 100
+        # Background + title per canvas size, and layouts per (width, height, count)
+        self._bases: Dict[Tuple[int, int], Image.Image] = {}
+        self._layouts: Dict[Tuple[int, int, int], MapLayout] = {}
 
     def _get_title_font(self, width: int) -> ImageFont.FreeTypeFont:
-        try:
-            font_size = min(width // 18, 70)
-            return ImageFont.truetype("arial.ttf", font_size)
-        except:
-            try:
-                return ImageFont.truetype("C:/Windows/Fonts/arial.ttf", font_size)
-            except:
-                return ImageFont.load_default()
+        return load_font(min(width // 18, 70))
 
     def _get_label_font(self, cell_size: int) -> ImageFont.FreeTypeFont:
+        return load_font(max(cell_size // 18, 16))
+
+    def _get_base(self, width: int, height: int) -> Image.Image:
+        """Blank canvas with background and title, drawn once per size."""
+        base = self._bases.get((width, height))
+        if base is None:
+            base = Image.new("RGB", (width, height), (255, 255, 255))
+            draw = ImageDraw.Draw(base)
+            title_font = self._get_title_font(width)
+            title_bbox = draw.textbbox((0, 0), self.title, font=title_font)
+            title_width = title_bbox[2] - title_bbox[0]
+            title_x = (width - title_width) // 2
+            title_y = self.margin // 2
+            draw.text((title_x, title_y), self.title, fill=(30, 30, 30), font=title_font)
+            self._bases[(width, height)] = base
+        return base
+
+    def _get_layout(self, width: int, height: int, count: int) -> MapLayout:
+        layout = self._layouts.get((width, height, count))
+        if layout is None:
+            rows, cols = choose_grid(count)
+
+            available_width = width - 2 * self.margin
+            available_height = height - 2 * self.margin - self.title_height
+
+            cell_width = (available_width - (cols - 1) * self.padding) // cols
+            cell_height = (available_height - (rows - 1) * self.padding) // rows
+
+            boxes = place_cells(rows, cols, available_width, available_height, count)
+            grid_start_x = self.margin
+            grid_start_y = self.margin + self.title_height
+
+            label_font = self._get_label_font(min(cell_width, cell_height))
+            layout = MapLayout(
+                rows=rows,
+                cols=cols,
+                cell_width=cell_width,
+                cell_height=cell_height,
+                positions=[(grid_start_x + x0, grid_start_y + y0) for x0, y0, _, _ in boxes],
+                label_font=label_font,
+                label_offset_y=cell_height - label_font.size - 10,
+            )
+            self._layouts[(width, height, count)] = layout
+        return layout
+
+    def warm_templates(self) -> None:
+        """Pre-render base canvases and layouts for every format and wish count."""
+        for _, width, height in FORMATS.values():
+            self._get_base(width, height)
+            for count in WISH_COUNTS:
+                self._get_layout(width, height, count)
+        logger.info(f"🧩 Map templates ready: {len(self._bases)} canvases, {len(self._layouts)} layouts")
+
+    async def warm_render(self, work_dir: Path) -> None:
+        """
+        Render a tiny map end to end, so Pillow's PNG/JPEG codecs, the
+        placeholder path and the render scheduler are exercised before the
+        first real job.
+        """
+        work_dir.mkdir(parents=True, exist_ok=True)
+        width, height, count = 360, 640, WISH_COUNTS[0]
+        layout = self._get_layout(width, height, count)
+        side = min(layout.cell_width, layout.cell_height)
+        tiles = [
+            str(create_placeholder(side, side, f"{idx + 1}", work_dir / f"tile-{idx}.png"))
+            for idx in range(count)
+        ]
+        output_path = work_dir / "map.png"
+        preview_path = work_dir / "map.preview.jpg"
         try:
-            font_size = max(cell_size // 18, 16)
-            return ImageFont.truetype("arial.ttf", font_size)
-        except:
-            try:
-                return ImageFont.truetype("C:/Windows/Fonts/arial.ttf", font_size)
-            except:
-                return ImageFont.load_default()
+            await self.assemble(tiles, [f"{idx + 1}" for idx in range(count)], output_path, width, height, preview_path)
+        finally:
+            for path in [*map(Path, tiles), output_path, preview_path]:
+                path.unlink(missing_ok=True)
+        logger.info("🧩 Warm-up render done")
+
+    def estimate_peak_bytes(self, width: int, height: int, count: int) -> int:
+        """
+        Rough peak memory of one render.
+
+        Pillow keeps RGB images at 4 bytes per pixel. A render holds the canvas
+        copy plus the working set of one tile at a time: the decoded source, its
+        RGB conversion and the resized cell. PNG encoding adds buffers of about
+        half the canvas; the preview, made afterwards by an integer reduce(), is
+        at most a quarter of the canvas and fits in the same allowance.
+        """
+        layout = self._get_layout(width, height, count)
+        canvas = width * height * 4
+        tile = 2 * TILE_DECODE_SIDE * TILE_DECODE_SIDE * 4 + layout.cell_width * layout.cell_height * 4
+        return canvas + tile + canvas // 2
 
     async def assemble(
         self,
@@ -44,9 +143,16 @@ class MapAssembler:
         labels: List[str],
         output_path: Path,
         width: int,
-        height: int
+        height: int,
+        preview_path: Optional[Path] = None,
+        deadline: Optional[Deadline] = None
     ) -> Path:
+        """
+        Render the map once the render scheduler admits it.
 
+        Waiting for admission and rendering both count against the deadline;
+        DeadlineExceeded is raised instead of answering after it.
+        """
         logger.info("🧩 Starting wish map assembly...")
         logger.info(f"➡️ Images: {len(image_urls)} | Labels: {labels}")
         logger.info(f"➡️ Target size: {width}x{height}")
@@ -55,47 +161,52 @@ class MapAssembler:
             raise ValueError("image_urls and labels must not be empty")
 
         count = len(image_urls)
-        rows, cols = choose_grid(count)
+        peak_bytes = self.estimate_peak_bytes(width, height, count)
 
-        logger.info(f"📐 Grid configuration: {rows} rows x {cols} cols")
+        async def admit_and_render() -> Path:
+            async with get_render_scheduler().reserve(peak_bytes):
+                return await self._render(image_urls, labels, output_path, width, height, preview_path)
 
-        available_width = width - 2 * self.margin
-        available_height = height - 2 * self.margin - self.title_height
+        return await (deadline or Deadline()).run(admit_and_render(), "render")
 
-        cell_width = (available_width - (cols - 1) * self.padding) // cols
-        cell_height = (available_height - (rows - 1) * self.padding) // rows
+    async def _render(
+        self,
+        image_urls: List[str],
+        labels: List[str],
+        output_path: Path,
+        width: int,
+        height: int,
+        preview_path: Optional[Path] = None
+    ) -> Path:
+        count = len(image_urls)
+        layout = self._get_layout(width, height, count)
+        cell_width, cell_height = layout.cell_width, layout.cell_height
+        label_font = layout.label_font
 
+        logger.info(f"📐 Grid configuration: {layout.rows} rows x {layout.cols} cols")
         logger.info(f"🧱 Cell size: {cell_width}x{cell_height}")
 
-        canvas = Image.new("RGB", (width, height), (255, 255, 255))
+        # Per-job setup is a single copy of the pre-drawn template
+        canvas = self._get_base(width, height).copy()
         draw = ImageDraw.Draw(canvas)
 
-        # Title
-        title_font = self._get_title_font(width)
-        title_bbox = draw.textbbox((0, 0), self.title, font=title_font)
-        title_width = title_bbox[2] - title_bbox[0]
-        title_x = (width - title_width) // 2
-        title_y = self.margin // 2
-        draw.text((title_x, title_y), self.title, fill=(30, 30, 30), font=title_font)
-
-        # Layout placement
-        boxes = place_cells(rows, cols, available_width, available_height, count)
-        grid_start_x = self.margin
-        grid_start_y = self.margin + self.title_height
-
-        label_font = self._get_label_font(min(cell_width, cell_height))
-
         # Processing each image
-        for idx, (image_url, label, box) in enumerate(zip(image_urls, labels, boxes)):
+        for idx, (image_url, label, (paste_x, paste_y)) in enumerate(zip(image_urls, labels, layout.positions)):
             logger.info(f"⬇️ Downloading image {idx+1}/{count}: {image_url}")
 
-            image_path = await download_image(image_url)
+            if not image_url.startswith("http") and Path(image_url).exists():
+                image_path = Path(image_url)
+            else:
+                image_path = await download_image(image_url)
             if image_path is None:
                 logger.error(f"❌ Failed to download image {idx}, using placeholder")
                 image_path = create_placeholder(cell_width, cell_height, label[:30])
 
             try:
-                img = Image.open(image_path).convert("RGB")
+                with Image.open(image_path) as src:
+                    # JPEG tiles are decoded straight at (close to) cell size
+                    src.draft("RGB", (cell_width, cell_height))
+                    img = src.convert("RGB")
 
                 # KOLORS always returns 1:1 → but we may still enforce it:
                 img_w, img_h = img.size
@@ -110,17 +221,16 @@ class MapAssembler:
 
                 img = img.resize((cell_width, cell_height), Image.Resampling.LANCZOS)
 
-                cell_x0, cell_y0, _, _ = box
-                paste_x = grid_start_x + cell_x0
-                paste_y = grid_start_y + cell_y0
-
                 canvas.paste(img, (paste_x, paste_y))
+                # Release the tile right away so peak memory stays near canvas + one tile
+                img.close()
+                del img
 
                 # Label
                 label_bbox = draw.textbbox((0, 0), label, font=label_font)
                 label_width = label_bbox[2] - label_bbox[0]
                 label_x = paste_x + (cell_width - label_width) // 2
-                label_y = paste_y + cell_height - label_font.size - 10
+                label_y = paste_y + layout.label_offset_y
 
                 draw.text((label_x + 2, label_y + 2), label, fill="black", font=label_font)
                 draw.text((label_x, label_y), label, fill="white", font=label_font)
@@ -128,17 +238,17 @@ class MapAssembler:
             except Exception as e:
                 logger.error(f"❌ Image processing failed ({idx}): {e}")
                 try:
-                    cell_x0, cell_y0, _, _ = box
-                    paste_x = grid_start_x + cell_x0
-                    paste_y = grid_start_y + cell_y0
-                    placeholder_img = Image.open(create_placeholder(cell_width, cell_height, label[:30]))
-                    canvas.paste(placeholder_img, (paste_x, paste_y))
+                    with Image.open(create_placeholder(cell_width, cell_height, label[:30])) as placeholder_img:
+                        canvas.paste(placeholder_img, (paste_x, paste_y))
                 except Exception as placeholder_err:
                     logger.error(f"Failed to create placeholder: {placeholder_err}")
 
         # Save final map
         output_path.parent.mkdir(parents=True, exist_ok=True)
         canvas.save(output_path, "PNG")
+        if preview_path is not None:
+            save_preview(canvas, preview_path)
+        canvas.close()
         logger.info(f"🎉 Wish map successfully saved to {output_path}")
 
         return output_path
@@ -0,0 +1,165 @@
+"""Tile generation stage of the map pipeline."""
+import asyncio
+import uuid
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from app.config import BATCH_TILE_CONCURRENCY, RENDER_RESERVE_SECONDS, TILE_CONCURRENCY, TMP_DIR
+from app.services.job_runner import detach, wait_for_batch_turn
+from app.services.job_store import get_store
+from app.services.kolors_client import get_client
+from app.services.selfies import selfie_inline
+from app.services.tile_cache import cache_tile, get_cached_tile, tile_key
+from app.utils.deadline import Deadline
+from app.utils.images import create_placeholder
+from app.utils.tracing import span
+
+
+@dataclass
+class TileResult:
+    url: str  # generated image URL, or "placeholder:<path>"
+    source: str  # local path (or URL) handed to the assembler
+    degraded: bool = False  # placeholder instead of a generated image
+    cached: bool = False  # reused from the tile cache (or from another job's generation)
+
+
+# Generations in progress in this worker, by tile key: concurrent jobs asking
+# for the same selfie and wish wait for one Kolors call instead of making their own
+_in_flight: Dict[str, asyncio.Task] = {}
+
+
+def placeholder_tile(wish: str, width: int, height: int) -> TileResult:
+    placeholder_path = TMP_DIR / f"placeholder-{uuid.uuid4().hex}.png"
+    create_placeholder(width, height, wish[:50], placeholder_path)
+    return TileResult(url=f"placeholder:{placeholder_path}", source=str(placeholder_path), degraded=True)
+
+
+async def generate_tile(
+    job_id: str,
+    idx: int,
+    wish: str,
+    reference_url: str,
+    selfie_hash: str,
+    width: int,
+    height: int,
+) -> TileResult:
+    """
+    Return the cached tile for this selfie and wish, or generate and cache it.
+
+    An empty reference_url sends the prepared selfie to Kolors inline.
+    """
+    store = get_store()
+    key = tile_key(selfie_hash, wish)
+    cached = get_cached_tile(key)
+    if cached:
+        logger.info(f"♻️ Tile cache hit {idx+1}: {wish}")
+        store.increment_done(job_id)
+        return TileResult(url=cached.url, source=str(cached.path), cached=True)
+
+    while True:
+        shared = _in_flight.get(key)
+        if shared is None:
+            break
+        logger.info(f"🔗 Joining in-flight generation {idx+1}: {wish}")
+        # asyncio.wait does not raise if the owner's generation gets cancelled
+        await asyncio.wait({shared})
+        if not shared.cancelled():
+            store.increment_done(job_id)
+            result = shared.result()
+            return result if result.degraded else replace(result, cached=True)
+
+    task = asyncio.create_task(_generate_tile(idx, wish, key, reference_url, selfie_hash, width, height))
+    _in_flight[key] = task
+
+    def _forget(done: asyncio.Task) -> None:
+        if _in_flight.get(key) is done:
+            del _in_flight[key]
+
+    task.add_done_callback(_forget)
+    # Cancelling this job cancels the generation; jobs that joined it retry on their own
+    result = await task
+    store.increment_done(job_id)
+    return result
+
+
+async def _generate_tile(
+    idx: int,
+    wish: str,
+    key: str,
+    reference_url: str,
+    selfie_hash: str,
+    width: int,
+    height: int,
+) -> TileResult:
+    logger.info(f"🖼 Generating image {idx+1}: {wish}")
+
+    try:
+        with span("generate", tile=idx):
+            image_url = await get_client().generate_wish_image(
+                wish_text=wish,
+                photo_url=reference_url or await selfie_inline(selfie_hash),
+                width=width,
+                height=height
+            )
+
+        if image_url:
+            logger.info(f"✔ Image generated: {image_url}")
+            tile_path = await cache_tile(key, image_url)
+            return TileResult(url=image_url, source=str(tile_path) if tile_path else image_url)
+        logger.warning(f"❌ Kolors failed, making placeholder...")
+
+    except Exception as e:
+        logger.opt(exception=True).error(f"❌ Exception during generation: {e}")
+
+    return placeholder_tile(wish, width, height)
+
+
+async def generate_tiles(
+    job_id: str,
+    wishes: List[str],
+    reference_url: str,
+    selfie_hash: str,
+    width: int,
+    height: int,
+    deadline: Optional[Deadline] = None,
+    low_priority: bool = False,
+) -> List[TileResult]:
+    """
+    Generate all tiles of a map concurrently, within the deadline.
+
+    When the deadline (minus the time reserved for rendering) runs out, tiles
+    that are not ready yet are replaced with placeholders and marked degraded.
+    Their generation keeps running in the background and lands in the tile
+    cache, so a later request for the same map can fill them in.
+
+    Low-priority (batch) maps run fewer tiles at once and hold each one back
+    while interactive work is in progress (see wait_for_batch_turn).
+    """
+    semaphore = asyncio.Semaphore(BATCH_TILE_CONCURRENCY if low_priority else TILE_CONCURRENCY)
+
+    async def run(idx: int, wish: str) -> TileResult:
+        async with semaphore:
+            if low_priority:
+                await wait_for_batch_turn()
+            return await generate_tile(job_id, idx, wish, reference_url, selfie_hash, width, height)
+
+    tasks = [asyncio.create_task(run(idx, wish)) for idx, wish in enumerate(wishes)]
+    timeout = deadline.remaining(RENDER_RESERVE_SECONDS) if deadline else None
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+    except asyncio.CancelledError:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if pending:
+        logger.warning(f"⏰ Deadline reached with {len(pending)}/{len(tasks)} tiles pending, using placeholders")
+        for task in pending:
+            detach(job_id, task)
+
+    return [
+        task.result() if task in done else placeholder_tile(wish, width, height)
+        for task, wish in zip(tasks, wishes)
+    ]
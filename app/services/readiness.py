@@ -0,0 +1,109 @@
+"""Startup warm-up and readiness checks of a backend worker."""
+import asyncio
+import shutil
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from loguru import logger
+
+from app.config import KOLORS_API_URL, READY_MIN_FREE_DISK_MB, READY_PROBE_INTERVAL_SECONDS, TMP_DIR
+from app.services.job_runner import running_jobs
+from app.services.kolors_client import get_client
+from app.services.map_assembler import get_assembler
+from app.services.render_scheduler import get_render_scheduler
+from app.utils.http import get_http_client
+
+_warmed = False
+# Warm-up started by /ready after a failed startup warm-up
+_warm_up_task: Optional[asyncio.Task] = None
+# Last Kolors probe: (monotonic time, reachable, detail)
+_kolors_probe: Optional[Tuple[float, bool, str]] = None
+
+
+async def probe_kolors(force: bool = False) -> Tuple[bool, str]:
+    """
+    Check that the Kolors host answers at all; any HTTP status counts as reachable.
+
+    The result is reused for READY_PROBE_INTERVAL_SECONDS so frequent
+    readiness checks do not turn into traffic to Kolors.
+    """
+    global _kolors_probe
+    now = time.monotonic()
+    if not force and _kolors_probe is not None and now - _kolors_probe[0] < READY_PROBE_INTERVAL_SECONDS:
+        return _kolors_probe[1], _kolors_probe[2]
+
+    parsed = urlparse(KOLORS_API_URL)
+    origin = f"{parsed.scheme}://{parsed.netloc}/"
+    try:
+        resp = await get_http_client().head(origin, timeout=5.0)
+        reachable, detail = True, f"HTTP {resp.status_code}"
+    except httpx.HTTPError as e:
+        reachable, detail = False, f"{type(e).__name__}: {e}"
+    _kolors_probe = (now, reachable, detail)
+    return reachable, detail
+
+
+async def warm_up() -> None:
+    """
+    Pay the first-request costs at startup: fonts and per-format templates,
+    the pooled TLS connection to Kolors and one tiny end-to-end render.
+
+    If the render fails the worker stays not ready, and the next /ready call
+    starts the warm-up again.
+    """
+    global _warmed
+    started = time.monotonic()
+    assembler = get_assembler()
+    # Loads every title and label font size along with the canvases and layouts
+    assembler.warm_templates()
+
+    reachable, detail = await probe_kolors(force=True)
+    if reachable:
+        logger.info(f"🔌 Kolors connection pool opened ({detail})")
+    else:
+        logger.warning(f"🔌 Kolors is unreachable at startup: {detail}")
+
+    try:
+        await assembler.warm_render(TMP_DIR / "warmup")
+    except Exception as e:
+        logger.opt(exception=True).error(f"Warm-up render failed: {e}")
+        return
+
+    _warmed = True
+    logger.info(f"🔥 Warm-up finished in {time.monotonic() - started:.1f}s")
+
+
+async def readiness() -> Tuple[bool, Dict[str, Any]]:
+    """
+    Report whether this worker should receive traffic, with the details.
+
+    Not ready while warm-up has not finished or when TMP_DIR is nearly full.
+    Kolors reachability and the circuit breaker are reported but do not fail
+    readiness: Kolors being down affects every instance alike, and maps are
+    still delivered with placeholders.
+    """
+    global _warm_up_task
+    if not _warmed and (_warm_up_task is None or _warm_up_task.done()):
+        _warm_up_task = asyncio.create_task(warm_up())
+
+    reachable, detail = await probe_kolors()
+    disk = shutil.disk_usage(TMP_DIR)
+    free_mb = disk.free // 2**20
+    scheduler = get_render_scheduler()
+    breaker = get_client().breaker
+
+    checks = {
+        "warmed_up": _warmed,
+        "kolors": {"reachable": reachable, "detail": detail},
+        "disk": {"free_mb": free_mb, "min_free_mb": READY_MIN_FREE_DISK_MB, "ok": free_mb >= READY_MIN_FREE_DISK_MB},
+        "queue": {
+            "running_jobs": running_jobs(),
+            "active_renders": scheduler.active,
+            "queued_renders": scheduler.queued,
+        },
+        "circuit_breaker": breaker.state,
+    }
+    ready = _warmed and checks["disk"]["ok"]
+    return ready, checks
@@ -0,0 +1,91 @@
+"""Memory-budgeted admission of map renders."""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional, Tuple
+
+from loguru import logger
+
+from app.config import RENDER_MEMORY_BUDGET_MB
+
+
+class RenderScheduler:
+    """
+    Admits renders while their estimated peak memory fits the budget.
+
+    Renders that do not fit wait in FIFO order, so a large A4 render is not
+    starved by a stream of smaller ones. A render larger than the whole budget
+    is still admitted, but only when nothing else is running.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.in_use_bytes = 0
+        self.active = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.in_use_bytes + nbytes <= self.budget_bytes or self.active == 0
+
+    def _admit(self, nbytes: int) -> None:
+        self.in_use_bytes += nbytes
+        self.active += 1
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            nbytes, fut = self._waiters.popleft()
+            if fut.done():
+                continue
+            self._admit(nbytes)
+            fut.set_result(None)
+
+    def _release(self, nbytes: int) -> None:
+        self.in_use_bytes -= nbytes
+        self.active -= 1
+        self._wake_waiters()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        """Wait until nbytes of the budget are free and hold them for the block."""
+        if not self._waiters and self._fits(nbytes):
+            self._admit(nbytes)
+        else:
+            logger.info(
+                f"⏳ Render queued: needs {nbytes / 2**20:.0f} MB, "
+                f"{self.in_use_bytes / 2**20:.0f}/{self.budget_bytes / 2**20:.0f} MB in use, "
+                f"{self.queued} ahead"
+            )
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append((nbytes, fut))
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # Admitted just as we were cancelled: hand the slot back
+                    self._release(nbytes)
+                else:
+                    try:
+                        self._waiters.remove((nbytes, fut))
+                    except ValueError:
+                        pass
+                    self._wake_waiters()
+                raise
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+
+# Singleton instance
+_scheduler: Optional[RenderScheduler] = None
+
+
+def get_render_scheduler() -> RenderScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RenderScheduler(RENDER_MEMORY_BUDGET_MB * 2**20)
+    return _scheduler
@@ -0,0 +1,102 @@
+"""Selfie preprocessing and local storage for Kolors reference images."""
+import asyncio
+import base64
+import hashlib
+import io
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from PIL import Image, ImageOps
+from loguru import logger
+
+from app.config import SELFIE_MAX_SIDE, SELFIE_PUBLIC_BASE_URL, SELFIES_DIR
+from app.utils.http import get_http_client
+
+
+def selfie_path(selfie_hash: str) -> Path:
+    return SELFIES_DIR / f"{selfie_hash}.jpg"
+
+
+def selfie_public_url(selfie_hash: str) -> Optional[str]:
+    """URL Kolors fetches the prepared selfie from, if the backend is publicly reachable."""
+    if not SELFIE_PUBLIC_BASE_URL:
+        return None
+    return f"{SELFIE_PUBLIC_BASE_URL.rstrip('/')}/api/selfies/{selfie_hash}"
+
+
+async def selfie_inline(selfie_hash: str) -> str:
+    """Prepared selfie as base64, sent to Kolors when it cannot fetch it from us."""
+    data = await asyncio.to_thread(selfie_path(selfie_hash).read_bytes)
+    return base64.b64encode(data).decode()
+
+
+def _process_selfie(data: bytes, output_path: Path) -> None:
+    img = Image.open(io.BytesIO(data))
+    # Let the JPEG decoder downscale by a power of two while decoding
+    img.draft("RGB", (SELFIE_MAX_SIDE * 2, SELFIE_MAX_SIDE * 2))
+    img = ImageOps.exif_transpose(img).convert("RGB")
+
+    # Square crop around where the face usually is in a selfie: centred
+    # horizontally, biased towards the upper part of portrait shots.
+    width, height = img.size
+    side = min(width, height)
+    left = (width - side) // 2
+    top = int((height - side) * 0.3)
+    img = img.crop((left, top, left + side, top + side))
+
+    if side > SELFIE_MAX_SIDE:
+        img = img.resize((SELFIE_MAX_SIDE, SELFIE_MAX_SIDE), Image.Resampling.LANCZOS)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_suffix(".tmp")
+    img.save(tmp_path, "JPEG", quality=88, optimize=True)
+    tmp_path.replace(output_path)
+
+
+async def prepare_selfie(selfie_url: Optional[str] = None, selfie_b64: Optional[str] = None) -> str:
+    """
+    Load the selfie once, normalize it and store it under its content hash.
+
+    Args:
+        selfie_url: URL to fetch the original photo from (used if no bytes given)
+        selfie_b64: Base64-encoded original photo
+
+    Returns:
+        Hash of the original photo, which keys the stored selfie and the tile cache
+
+    Raises:
+        ValueError: if the selfie cannot be loaded or decoded
+    """
+    if selfie_b64:
+        try:
+            data = base64.b64decode(selfie_b64)
+        except ValueError as e:
+            raise ValueError(f"Invalid selfie_b64: {e}")
+    elif selfie_url:
+        try:
+            resp = await get_http_client().get(selfie_url, timeout=30.0)
+            resp.raise_for_status()
+            data = resp.content
+        except httpx.HTTPError as e:
+            raise ValueError(f"Failed to fetch selfie: {e}")
+    else:
+        raise ValueError("Either selfie_url or selfie_b64 is required")
+
+    selfie_hash = hashlib.sha256(data).hexdigest()[:32]
+    output_path = selfie_path(selfie_hash)
+    if output_path.exists():
+        # Keeps a selfie in use from being removed by the periodic cleanup
+        output_path.touch()
+        logger.info(f"🤳 Selfie already prepared: {selfie_hash}")
+        return selfie_hash
+
+    try:
+        await asyncio.to_thread(_process_selfie, data, output_path)
+    except Exception as e:
+        raise ValueError(f"Invalid selfie image: {e}")
+
+    logger.info(
+        f"🤳 Selfie prepared: {selfie_hash} ({len(data)} -> {output_path.stat().st_size} bytes)"
+    )
+    return selfie_hash
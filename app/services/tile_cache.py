@@ -0,0 +1,32 @@
+"""Cache of generated wish tiles, shared by all workers through the job store."""
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from app.config import IMAGES_DIR
+from app.services.job_store import TileRecord, get_store
+from app.utils.images import download_image
+
+# Bump when the prompt or model changes so old tiles are not reused
+TILE_VERSION = "kling-v1/1"
+
+
+def tile_key(selfie_hash: str, wish: str) -> str:
+    raw = f"{TILE_VERSION}\n{selfie_hash}\n{wish.strip().lower()}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get_cached_tile(key: str) -> Optional[TileRecord]:
+    return get_store().get_tile(key)
+
+
+async def cache_tile(key: str, image_url: str) -> Optional[Path]:
+    """Download a generated tile into IMAGES_DIR and index it under key."""
+    path = await download_image(image_url, IMAGES_DIR / f"tile-{key[:32]}.png")
+    if path is None:
+        return None
+    get_store().put_tile(key, image_url, path)
+    logger.info(f"💾 Tile cached: {key[:12]}")
+    return path
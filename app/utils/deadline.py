@@ -0,0 +1,42 @@
+"""Request deadlines propagated through the map pipeline."""
+import asyncio
+import time
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage of the pipeline could not finish before the deadline."""
+
+
+class Deadline:
+    """Point in time by which the client expects an answer (None = no deadline)."""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+
+    def remaining(self, reserve: float = 0.0) -> Optional[float]:
+        """Seconds left after keeping `reserve` for later stages; None if unbounded."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic() - reserve)
+
+    def expired(self, reserve: float = 0.0) -> bool:
+        remaining = self.remaining(reserve)
+        return remaining is not None and remaining <= 0
+
+    async def run(self, aw: Awaitable[T], stage: str) -> T:
+        """
+        Await aw within the time left.
+
+        Raises:
+            DeadlineExceeded: if the deadline passed first (aw is cancelled)
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return await aw
+        try:
+            return await asyncio.wait_for(aw, remaining)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Deadline reached during {stage}")
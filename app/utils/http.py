@@ -0,0 +1,33 @@
+"""Shared outbound HTTP connection pool."""
+from typing import Optional
+
+import httpx
+
+from app.config import HTTP_KEEPALIVE_SECONDS, HTTP_MAX_CONNECTIONS
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Pooled client reused across requests, so TLS sessions to Kolors and the
+    image CDN stay open between jobs. Callers pass their own timeout per request.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+            ),
+        )
+    return _client
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
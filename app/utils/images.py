@@ -1,14 +1,26 @@
 """Image utilities for downloading and processing."""
 import base64
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 from urllib.parse import urlparse
 
-import httpx
-from PIL import Image
+from PIL import Image, ImageFont
 from loguru import logger
 
-from app.config import TMP_DIR
+from app.config import PREVIEW_MAX_BYTES, PREVIEW_MAX_SIDE, TMP_DIR
+from app.utils.http import get_http_client
+
+
+@lru_cache(maxsize=64)
+def load_font(size: int) -> ImageFont.ImageFont:
+    """Arial at the given size, or Pillow's default font; loaded once per size."""
+    for font_path in ("arial.ttf", "C:/Windows/Fonts/arial.ttf"):
+        try:
+            return ImageFont.truetype(font_path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
 
 
 async def download_image(url: str, output_path: Optional[Path] = None) -> Optional[Path]:
@@ -27,15 +39,14 @@ async def download_image(url: str, output_path: Optional[Path] = None) -> Option
         output_path = TMP_DIR / f"downloaded-{hash(url) % 100000}{ext}"
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-            output_path.write_bytes(response.content)
-            
-            # Verify it's a valid image
-            Image.open(output_path).verify()
-            logger.info(f"Downloaded image: {url} -> {output_path}")
-            return output_path
+        response = await get_http_client().get(url, timeout=30.0)
+        response.raise_for_status()
+        output_path.write_bytes(response.content)
+
+        # Verify it's a valid image
+        Image.open(output_path).verify()
+        logger.info(f"Downloaded image: {url} -> {output_path}")
+        return output_path
     except Exception as e:
         logger.error(f"Failed to download image from {url}: {e}")
         return None
@@ -59,7 +70,7 @@ def create_placeholder(width: int, height: int, text: str = "", output_path: Opt
     
     # Create gradient background
     img = Image.new("RGB", (width, height), (150, 150, 200))
-    from PIL import ImageDraw, ImageFont
+    from PIL import ImageDraw
     
     draw = ImageDraw.Draw(img)
     
@@ -72,14 +83,7 @@ def create_placeholder(width: int, height: int, text: str = "", output_path: Opt
     
     # Add text if provided
     if text:
-        try:
-            font_size = min(width // 15, height // 15, 48)
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except:
-            try:
-                font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", font_size)
-            except:
-                font = ImageFont.load_default()
+        font = load_font(min(width // 15, height // 15, 48))
         
         # Center text
         bbox = draw.textbbox((0, 0), text, font=font)
@@ -97,3 +101,29 @@ def create_placeholder(width: int, height: int, text: str = "", output_path: Opt
     return output_path
 
 
+def save_preview(img: Image.Image, output_path: Path) -> Path:
+    """
+    Save a JPEG preview of a map, downscaled by a whole factor to at most
+    PREVIEW_MAX_SIDE and capped at PREVIEW_MAX_BYTES.
+
+    Args:
+        img: Full-resolution map (left untouched)
+        output_path: Where to write the JPEG
+
+    Returns:
+        Path to the preview
+    """
+    # reduce() allocates only the small output; copy() + thumbnail() (or a
+    # two-pass resize) would hold a near full-resolution image on top of the
+    # canvas, which the render memory budget does not account for
+    factor = -(-max(img.size) // PREVIEW_MAX_SIDE)
+    preview = img.reduce(factor) if factor > 1 else img
+
+    for quality in (85, 75, 65, 50):
+        preview.save(output_path, "JPEG", quality=quality, optimize=True)
+        if output_path.stat().st_size <= PREVIEW_MAX_BYTES:
+            break
+    if preview is not img:
+        preview.close()
+    logger.info(f"Created preview: {output_path} ({output_path.stat().st_size} bytes, q={quality})")
+    return output_path
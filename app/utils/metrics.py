@@ -0,0 +1,38 @@
+"""Minimal in-process metrics registry with Prometheus text output."""
+from typing import Dict, Tuple
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+_counters: Dict[str, Dict[_LabelKey, float]] = {}
+_gauges: Dict[str, Dict[_LabelKey, float]] = {}
+
+
+def _key(labels: Dict[str, str]) -> _LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    series = _counters.setdefault(name, {})
+    key = _key(labels)
+    series[key] = series.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    _gauges.setdefault(name, {})[_key(labels)] = value
+
+
+def get_value(name: str, **labels: str) -> float:
+    key = _key(labels)
+    return _counters.get(name, {}).get(key, _gauges.get(name, {}).get(key, 0.0))
+
+
+def render() -> str:
+    """Render all metrics of this worker process in Prometheus text format."""
+    lines = []
+    for kind, registry in (("counter", _counters), ("gauge", _gauges)):
+        for name in sorted(registry):
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in registry[name].items():
+                labels = ",".join(f'{k}="{v}"' for k, v in key)
+                lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
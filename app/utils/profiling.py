@@ -0,0 +1,99 @@
+"""Opt-in per-request profiling of the map pipeline.
+
+Uses pyinstrument (HTML report) when it is installed, otherwise a small
+built-in sampler that writes collapsed stacks for flamegraph.pl or
+speedscope. Nothing is installed or sampled unless a request asks for it.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+from loguru import logger
+
+from app.config import PROFILE_SAMPLE_INTERVAL_MS, PROFILES_DIR
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # optional dependency
+    Profiler = None
+
+PROFILE_SUFFIXES = (".html", ".collapsed.txt")
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread.
+
+    Everything running on the event loop thread is sampled, so requests served
+    concurrently with the profiled one show up in the report too.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._sampler = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+def profile_path(job_id: str) -> Optional[Path]:
+    """Saved report of a job, if any."""
+    for suffix in PROFILE_SUFFIXES:
+        path = PROFILES_DIR / f"{job_id}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+@asynccontextmanager
+async def profile_request(job_id: str) -> AsyncIterator[None]:
+    """Profile the enclosed block and save the report under PROFILES_DIR."""
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    started = time.monotonic()
+    if Profiler is not None:
+        # Async mode attributes await time to this request only
+        profiler = Profiler(interval=PROFILE_SAMPLE_INTERVAL_MS / 1000, async_mode="enabled")
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = PROFILES_DIR / f"{job_id}.html"
+            path.write_text(profiler.output_html(), encoding="utf-8")
+    else:
+        sampler = StackSampler(PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            path = PROFILES_DIR / f"{job_id}.collapsed.txt"
+            path.write_text(sampler.collapsed(), encoding="utf-8")
+    logger.info(f"🔬 Profile saved: {path} ({time.monotonic() - started:.1f}s profiled)")
@@ -0,0 +1,131 @@
+"""Job tracing, secret redaction and structured logging setup."""
+import contextvars
+import json
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+from loguru import logger
+
+from app.config import LOG_JSON, LOG_LEVEL, LOG_SAMPLE_RATE
+
+_job_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("job_id", default=None)
+_span_path: contextvars.ContextVar[str] = contextvars.ContextVar("span_path", default="")
+
+# Secrets that must never reach a log sink, whatever the level or flag.
+_SECRET_PATTERNS = [
+    (re.compile(r"(api\.telegram\.org/file/bot)[^/\s]+"), r"\1***"),
+    (re.compile(r"\b\d{6,}:[A-Za-z0-9_-]{30,}\b"), "***"),
+    (re.compile(r"(Bearer\s+)[^\s'\"]+", re.IGNORECASE), r"\1***"),
+    (re.compile(r"\bsk-[A-Za-z0-9]{16,}\b"), "sk-***"),
+]
+_SECRET_KEYS = {"authorization", "api_key", "token", "bot_token", "x-admin-key"}
+_WARNING_NO = logger.level("WARNING").no
+
+
+def redact(value: Any) -> Any:
+    """Return a copy of value with tokens and API keys masked."""
+    if isinstance(value, str):
+        for pattern, repl in _SECRET_PATTERNS:
+            value = pattern.sub(repl, value)
+        return value
+    if isinstance(value, dict):
+        return {
+            k: "***" if str(k).lower() in _SECRET_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(v) for v in value)
+    return value
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+
+def current_job_id() -> Optional[str]:
+    return _job_id.get()
+
+
+@contextmanager
+def job_context(job_id: Optional[str] = None) -> Iterator[str]:
+    """
+    Bind a job id to every log record emitted inside the block.
+
+    The sampling decision is made once per job, so a sampled job keeps its
+    whole timeline and an unsampled one only keeps warnings and errors.
+    """
+    job_id = job_id or new_job_id()
+    sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+    token = _job_id.set(job_id)
+    try:
+        with logger.contextualize(job_id=job_id, sampled=sampled):
+            yield job_id
+    finally:
+        _job_id.reset(token)
+
+
+@contextmanager
+def span(name: str, **fields: Any) -> Iterator[None]:
+    """Time a pipeline stage and log one record with its duration and outcome."""
+    parent = _span_path.get()
+    path = f"{parent}/{name}" if parent else name
+    token = _span_path.set(path)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        _span_path.reset(token)
+        duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.bind(span=path, duration_ms=duration_ms, status=status, **fields).info(
+            f"span {path} {status} in {duration_ms}ms"
+        )
+
+
+def _redact_record(record) -> None:
+    record["message"] = redact(record["message"])
+
+
+def _sample_filter(record) -> bool:
+    return record["extra"].get("sampled", True) or record["level"].no >= _WARNING_NO
+
+
+def _json_sink(message) -> None:
+    record = message.record
+    entry = {
+        "ts": record["time"].isoformat(),
+        "level": record["level"].name,
+        "msg": record["message"],
+        "module": record["name"],
+    }
+    entry.update({k: v for k, v in record["extra"].items() if k != "sampled"})
+    if record["exception"] is not None:
+        entry["exc"] = redact(repr(record["exception"].value))
+    sys.stderr.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+
+def setup_logging() -> None:
+    """Replace loguru's default sink with a redacting, sampled one."""
+    logger.remove()
+    logger.configure(extra={"job_id": "-", "sampled": True}, patcher=_redact_record)
+    if LOG_JSON:
+        logger.add(_json_sink, level=LOG_LEVEL, filter=_sample_filter)
+    else:
+        logger.add(
+            sys.stderr,
+            level=LOG_LEVEL,
+            filter=_sample_filter,
+            diagnose=False,
+            format=(
+                "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+                "{extra[job_id]} | <cyan>{name}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+            ),
+        )
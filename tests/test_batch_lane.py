@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from app.services import job_runner
+from app.services.job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = JobStore(tmp_path / "state.db")
+    monkeypatch.setattr(job_runner, "get_store", lambda: store)
+    monkeypatch.setattr(job_runner, "BATCH_YIELD_POLL_SECONDS", 0.01)
+    monkeypatch.setattr(job_runner, "BATCH_MAX_WAIT_SECONDS", 0.05)
+    return store
+
+
+def test_batch_runs_when_idle(store):
+    store.create_job("batch", "phone", ["a", "b", "c"], lane="batch")
+    asyncio.run(asyncio.wait_for(job_runner.wait_for_batch_turn(), 0.02))
+
+
+def test_batch_yields_to_interactive_job_of_another_worker(store):
+    store.create_job("other", "phone", ["a", "b", "c"])
+
+    async def scenario():
+        turn = asyncio.create_task(job_runner.wait_for_batch_turn())
+        await asyncio.sleep(0.02)
+        assert not turn.done()
+        store.update_job("other", status="success")
+        await asyncio.wait_for(turn, 0.1)
+
+    asyncio.run(scenario())
+
+
+def test_batch_yields_to_open_draft(store):
+    store.create_job("draft", "", [], status="draft")
+    assert job_runner._interactive_busy()
+    store.update_job("draft", status="finalized")
+    assert not job_runner._interactive_busy()
+
+
+def test_batch_is_not_starved_by_steady_traffic(store):
+    store.create_job("other", "phone", ["a", "b", "c"])
+    asyncio.run(asyncio.wait_for(job_runner.wait_for_batch_turn(), 0.5))
+
+
+def test_stalled_interactive_job_is_ignored(store, monkeypatch):
+    store.create_job("other", "phone", ["a", "b", "c"])
+    monkeypatch.setattr(job_runner, "BATCH_STALE_JOB_SECONDS", -1)
+    assert not job_runner._interactive_busy()
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime
+
+from aiogram.types import Chat, Message, Update
+
+from app.bot.middlewares import ConcurrencyLimitMiddleware
+
+
+def update(text: str) -> Update:
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"), text=text)
+    return Update(update_id=1, message=message)
+
+
+def run_with_busy_slot(text: str) -> bool:
+    """Whether an update with text is handled while the only slot is taken."""
+    async def scenario():
+        middleware = ConcurrencyLimitMiddleware(1)
+        release = asyncio.Event()
+        handled = asyncio.Event()
+
+        async def busy(event, data):
+            await release.wait()
+
+        async def handle(event, data):
+            handled.set()
+
+        holder = asyncio.create_task(middleware(busy, update("wish"), {}))
+        await asyncio.sleep(0)
+        other = asyncio.create_task(middleware(handle, update(text), {}))
+        await asyncio.sleep(0.01)
+        result = handled.is_set()
+        release.set()
+        await asyncio.gather(holder, other)
+        return result
+
+    return asyncio.run(scenario())
+
+
+def test_reset_commands_bypass_the_limit():
+    for text in ("/start", "/cancel", "/help", "/start@WishMapBot payload"):
+        assert run_with_busy_slot(text), text
+
+
+def test_other_commands_and_text_wait_for_a_slot():
+    for text in ("/anything", "/startx", "ГОТОВО"):
+        assert not run_with_busy_slot(text), text
@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.main import app
+from app.services import job_store
+from app.services.job_store import JobStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = JobStore(tmp_path / "state.db")
+    monkeypatch.setattr(job_store, "_store", store)
+    return store
+
+
+def test_cancel_marks_a_running_job(store):
+    store.create_job("job", "phone", ["a", "b", "c"])
+    resp = TestClient(app).post("/api/jobs/job/cancel")
+
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "cancelled"
+    assert store.get_job("job").status == "cancelled"
+
+
+def test_cancel_of_a_finished_job_reports_its_status(store):
+    store.create_job("job", "phone", ["a", "b", "c"])
+    store.update_job("job", status="success")
+    resp = TestClient(app).post("/api/jobs/job/cancel")
+
+    assert resp.status_code == 409
+    assert "success" in resp.json()["detail"]
+    assert store.get_job("job").status == "success"
+
+
+def test_cancel_of_an_unknown_job(store):
+    assert TestClient(app).post("/api/jobs/nope/cancel").status_code == 404
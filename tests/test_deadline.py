@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from app.services.render_scheduler import RenderScheduler
+from app.utils.deadline import Deadline, DeadlineExceeded
+
+
+def test_run_without_deadline_waits_for_the_result():
+    async def scenario():
+        return await Deadline().run(asyncio.sleep(0.01, result="done"), "stage")
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_run_raises_when_the_deadline_passes():
+    async def scenario():
+        await Deadline(0.02).run(asyncio.sleep(1), "render")
+
+    with pytest.raises(DeadlineExceeded, match="render"):
+        asyncio.run(scenario())
+
+
+def test_queued_render_gives_up_at_the_deadline():
+    async def scenario():
+        scheduler = RenderScheduler(100)
+        release = asyncio.Event()
+
+        async def hold():
+            async with scheduler.reserve(80):
+                await release.wait()
+
+        async def queued():
+            async with scheduler.reserve(80):
+                pass
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await Deadline(0.02).run(queued(), "render")
+        assert scheduler.queued == 0
+        release.set()
+        await holder
+        assert scheduler.in_use_bytes == 0
+
+    asyncio.run(scenario())
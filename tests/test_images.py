@@ -0,0 +1,21 @@
+from PIL import Image
+
+from app.config import PREVIEW_MAX_SIDE
+from app.utils.images import save_preview
+
+
+def test_preview_is_capped_and_keeps_aspect_ratio(tmp_path):
+    img = Image.new("RGB", (PREVIEW_MAX_SIDE * 2, PREVIEW_MAX_SIDE), "red")
+    path = save_preview(img, tmp_path / "map.preview.jpg")
+
+    with Image.open(path) as preview:
+        assert preview.size == (PREVIEW_MAX_SIDE, PREVIEW_MAX_SIDE // 2)
+    assert img.size == (PREVIEW_MAX_SIDE * 2, PREVIEW_MAX_SIDE)
+
+
+def test_small_map_is_not_upscaled(tmp_path):
+    img = Image.new("RGB", (300, 200), "red")
+    path = save_preview(img, tmp_path / "map.preview.jpg")
+
+    with Image.open(path) as preview:
+        assert preview.size == (300, 200)
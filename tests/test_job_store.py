@@ -0,0 +1,48 @@
+from app.services.job_store import JobStore
+
+
+def make_store(tmp_path):
+    return JobStore(tmp_path / "state.db")
+
+
+def test_create_job_fills_in_a_registered_job(tmp_path):
+    store = make_store(tmp_path)
+    store.create_job("job", "phone", ["a", "b", "c"])
+    store.create_job("job", "phone", ["a", "b", "c"], "hash", "https://example.com/selfie.jpg")
+
+    job = store.get_job("job")
+    assert job.status == "running"
+    assert job.selfie_hash == "hash"
+    assert job.reference_url == "https://example.com/selfie.jpg"
+    assert job.total == 3
+
+
+def test_create_job_keeps_a_cancelled_job_cancelled(tmp_path):
+    store = make_store(tmp_path)
+    store.create_job("job", "phone", ["a", "b", "c"])
+    store.update_job("job", status="cancelled")
+    store.create_job("job", "phone", ["a", "b", "c"], "hash", "https://example.com/selfie.jpg")
+
+    assert store.get_job("job").status == "cancelled"
+
+
+def test_prune_jobs_keeps_recent_jobs(tmp_path):
+    store = make_store(tmp_path)
+    store.create_job("old", "phone", ["a", "b", "c"])
+    store._conn.execute("UPDATE jobs SET updated_at = 0 WHERE job_id = 'old'")
+    store.create_job("new", "phone", ["a", "b", "c"])
+
+    assert store.prune_jobs(min_updated=1000) == 1
+    assert store.get_job("old") is None
+    assert store.get_job("new") is not None
+
+
+def test_prune_tiles_returns_files_of_expired_tiles(tmp_path):
+    store = make_store(tmp_path)
+    old_path, new_path = tmp_path / "tile-old.png", tmp_path / "tile-new.png"
+    store.put_tile("old", "https://example.com/old.png", old_path)
+    store._conn.execute("UPDATE tiles SET created_at = 0 WHERE key = 'old'")
+    store.put_tile("new", "https://example.com/new.png", new_path)
+
+    assert store.prune_tiles() == [old_path]
+    assert store._conn.execute("SELECT key FROM tiles").fetchall()[0]["key"] == "new"
@@ -0,0 +1,109 @@
+import pytest
+
+from app.services import kolors_resilience
+from app.services.kolors_resilience import CircuitBreaker, LatencyTracker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(kolors_resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_breaker(**overrides):
+    options = dict(window=10, min_calls=4, failure_ratio=0.5, cooldown=30)
+    options.update(overrides)
+    return CircuitBreaker("test", **options)
+
+
+def test_breaker_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_opens_at_failure_ratio(clock):
+    breaker = make_breaker()
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_lets_one_probe_through(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+
+def test_breaker_closes_after_successful_probe(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    # The failures that opened it are forgotten
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_reopens_after_failed_probe(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock[0] += 10
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_frees_the_half_open_slot(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_cancelled()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_p95_needs_min_samples():
+    tracker = LatencyTracker("test", min_samples=5)
+    for seconds in range(4):
+        tracker.observe(seconds)
+    assert tracker.p95() is None
+    tracker.observe(4)
+    assert tracker.p95() == 4
+
+
+def test_p95_of_uniform_samples():
+    tracker = LatencyTracker("test", window=100, min_samples=20)
+    for seconds in range(1, 101):
+        tracker.observe(seconds)
+    assert tracker.p95() == 96
+
+
+def test_p95_uses_rolling_window():
+    tracker = LatencyTracker("test", window=20, min_samples=20)
+    for _ in range(20):
+        tracker.observe(100)
+    for _ in range(20):
+        tracker.observe(1)
+    assert tracker.p95() == 1
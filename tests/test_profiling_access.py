@@ -0,0 +1,37 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api.main import app
+from app.services import job_store
+from app.services.job_store import JobStore
+
+MAP_REQUEST = {"wishes": ["a", "b", "c"], "format": "phone", "selfie_b64": "AAAA"}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = JobStore(tmp_path / "state.db")
+    monkeypatch.setattr(job_store, "_store", store)
+    return store
+
+
+def test_rejected_profiling_request_leaves_no_job(store):
+    client = TestClient(app)
+    resp = client.post("/api/assemble_map?profile=1", json={**MAP_REQUEST, "job_id": "j3"})
+
+    assert resp.status_code == 403
+    assert store.get_job("j3") is None
+    assert store.count_active("interactive", 0) == 0
+
+
+def test_unprofilable_job_id_leaves_no_job(store, monkeypatch):
+    monkeypatch.setattr("app.api.routes.profiles.ADMIN_KEY", "secret")
+    client = TestClient(app)
+    resp = client.post(
+        "/api/assemble_map",
+        json={**MAP_REQUEST, "job_id": "bad id"},
+        headers={"X-Profile": "1", "X-Admin-Key": "secret"},
+    )
+
+    assert resp.status_code == 400
+    assert store.get_job("bad id") is None
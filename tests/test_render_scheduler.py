@@ -0,0 +1,121 @@
+import asyncio
+
+from app.services.render_scheduler import RenderScheduler
+
+
+async def hold(scheduler, nbytes, log, name, release):
+    async with scheduler.reserve(nbytes):
+        log.append(name)
+        await release.wait()
+
+
+def test_admits_while_budget_fits():
+    async def scenario():
+        scheduler = RenderScheduler(100)
+        release = asyncio.Event()
+        log = []
+        tasks = [asyncio.create_task(hold(scheduler, 40, log, name, release)) for name in "ab"]
+        await asyncio.sleep(0)
+        assert log == ["a", "b"]
+        assert scheduler.in_use_bytes == 80
+        assert scheduler.queued == 0
+        release.set()
+        await asyncio.gather(*tasks)
+        assert scheduler.in_use_bytes == 0
+        assert scheduler.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiters_are_admitted_in_fifo_order():
+    async def scenario():
+        scheduler = RenderScheduler(100)
+        log = []
+        first_release, big_release, small_release = asyncio.Event(), asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, 60, log, "first", first_release))
+        await asyncio.sleep(0)
+        big = asyncio.create_task(hold(scheduler, 80, log, "big", big_release))
+        await asyncio.sleep(0)
+        # Would fit next to "first", but must not overtake the queued big render
+        small = asyncio.create_task(hold(scheduler, 10, log, "small", small_release))
+        await asyncio.sleep(0)
+        assert log == ["first"]
+        assert scheduler.queued == 2
+
+        first_release.set()
+        await first
+        await asyncio.sleep(0)
+        assert log == ["first", "big", "small"]
+
+        big_release.set()
+        small_release.set()
+        await asyncio.gather(big, small)
+        assert scheduler.in_use_bytes == 0
+
+    asyncio.run(scenario())
+
+
+def test_render_larger_than_budget_runs_alone():
+    async def scenario():
+        scheduler = RenderScheduler(100)
+        log = []
+        release = asyncio.Event()
+        huge = asyncio.create_task(hold(scheduler, 500, log, "huge", release))
+        await asyncio.sleep(0)
+        assert log == ["huge"]
+        other = asyncio.create_task(hold(scheduler, 10, log, "other", release))
+        await asyncio.sleep(0)
+        assert log == ["huge"]
+        release.set()
+        await asyncio.gather(huge, other)
+        assert log == ["huge", "other"]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        scheduler = RenderScheduler(100)
+        log = []
+        first_release, release = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, 90, log, "first", first_release))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(hold(scheduler, 50, log, "cancelled", release))
+        waiting = asyncio.create_task(hold(scheduler, 10, log, "waiting", release))
+        await asyncio.sleep(0)
+        assert scheduler.queued == 2
+
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        await asyncio.sleep(0)
+        # The head of the queue is gone, so the small render now fits
+        assert log == ["first", "waiting"]
+        assert scheduler.queued == 0
+
+        first_release.set()
+        release.set()
+        await asyncio.gather(first, waiting)
+        assert scheduler.in_use_bytes == 0
+        assert scheduler.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_after_admission_returns_the_reservation():
+    async def scenario():
+        scheduler = RenderScheduler(100)
+        log = []
+        first_release, release = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, 90, log, "first", first_release))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(hold(scheduler, 50, log, "second", release))
+        await asyncio.sleep(0)
+        first_release.set()
+        await first
+        # Admitted by the release but cancelled before it got to run
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert scheduler.in_use_bytes == 0
+        assert scheduler.active == 0
+
+    asyncio.run(scenario())